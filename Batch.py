@@ -0,0 +1,413 @@
+import re, time, multiprocessing
+from collections import namedtuple, deque
+from itertools import islice
+import Citation, Plagiarism, Quotation
+from Citation import citation_features
+from Plagiarism import plagiarism_features, corpus_plagiarism_features
+from Quotation import quotation_features
+from Output import content_hash
+from Profiling import stage, start_essay, finish_essay
+
+# The token attributes the feature functions read from a spaCy Doc (get_tokens and quotation_features).
+# A list of these stands in for the Doc, so essays can be sent to worker processes without the spaCy vocab.
+Token = namedtuple('Token', ['text', 'is_stop', 'is_punct'])
+
+# Texts longer than this many characters (or than nlp.max_length) are parsed in chunks of at most this length,
+# split at paragraph boundaries (see parse_text), so a text of any length is parsed with the memory of one chunk
+parse_chunk_length = 100000
+
+# the characters that end a line (as str.splitlines() and Citation.paragraph_spans split a text)
+line_breaks = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+# the end of a paragraph: a run of whitespace with a line break, before the next non-whitespace character
+# (matched from the first line break of the run)
+paragraph_boundary = re.compile(r"[" + line_breaks + r"]\s*(?=\S)")
+# the end of a run of whitespace, before the next non-whitespace character
+whitespace_boundary = re.compile(r"\s+(?=\S)")
+
+# The feature groups (one per module) in the order of the output columns, and their module versions
+FEATURE_GROUPS = ['citation', 'plagiarism', 'quotation']
+FEATURE_VERSIONS = {'citation':   Citation.FEATURE_VERSION,
+                    'plagiarism': Plagiarism.FEATURE_VERSION,
+                    'quotation':  Quotation.FEATURE_VERSION}
+FEATURE_COLUMNS  = {'citation':   Citation.FEATURE_COLUMNS,
+                    'plagiarism': Plagiarism.FEATURE_COLUMNS,
+                    'quotation':  Quotation.FEATURE_COLUMNS}
+FEATURE_DTYPES   = {'citation':   Citation.FEATURE_DTYPES,
+                    'plagiarism': Plagiarism.FEATURE_DTYPES,
+                    'quotation':  Quotation.FEATURE_DTYPES}
+# the feature groups that depend on the source text, and those that need the spaCy parse
+SOURCE_GROUPS = {'plagiarism', 'quotation'}
+PARSE_GROUPS  = {'plagiarism', 'quotation'}
+
+# the source (SourceIndex or SourceLibrary) of a worker process, set once when the worker starts
+_worker_source = None
+
+
+def feature_group(column):
+    '''
+    :return: the feature group a column belongs to (also for the per-source columns of a SourceLibrary)
+    '''
+    for group in FEATURE_GROUPS:
+        for group_column in FEATURE_COLUMNS[group]:
+            if column == group_column or column.startswith(group_column + '_'):
+                return group
+    raise ValueError(f'unknown feature {column!r}')
+
+
+def column_dtype(column):
+    '''
+    :return: the dtype of a column of the feature dicts in a typed result table (see Results.ResultTable): that of
+             its feature (also for the per-source columns of a SourceLibrary), "string" for the filename, the
+             dtype of a profile column, and "object" for any other column
+    '''
+    if column == 'Filename':
+        return 'string'
+    if column.startswith('time_'):
+        return 'float64'
+    if column.startswith('peak_memory_'):
+        return 'int64'
+    for group in FEATURE_GROUPS:
+        for group_column, dtype in FEATURE_DTYPES[group].items():
+            if column == group_column or column.startswith(group_column + '_'):
+                return dtype
+    return 'object'
+
+
+def select_features(features=None):
+    '''
+    Resolve a selection of features to the feature groups that compute them
+    :param features: a list of feature groups ("citation", "plagiarism", "quotation") and/or column names;
+                     None selects all features
+    :return: (groups, columns): the feature groups to compute, in output order, and the set of selected columns
+             (None when only whole groups are selected)
+    '''
+    if features is None:
+        return list(FEATURE_GROUPS), None
+    if isinstance(features, str):
+        features = [features]
+    groups  = {feature for feature in features if feature in FEATURE_GROUPS}
+    columns = {feature for feature in features if feature not in FEATURE_GROUPS}
+    groups.update(feature_group(column) for column in columns)
+    if columns:
+        # whole groups keep all their columns
+        columns.update(column for group in groups.intersection(features) for column in FEATURE_COLUMNS[group])
+    return [group for group in FEATURE_GROUPS if group in groups], columns or None
+
+
+def feature_pipeline(features=None, model=None):
+    '''
+    The minimum spaCy pipeline the selected features need, loaded (and spaCy imported) only then:
+    None when no selected feature uses token data (citation features only), and otherwise a tokenizer without
+    any pipeline components. The features only use the text, is_stop and is_punct of the tokens and their
+    number, which come from the tokenizer and the English language data, so a blank English pipeline is
+    enough and starts in a fraction of the time of a trained model.
+    :param features: the selection of features (see select_features)
+    :param model: the name of a spaCy model to take the tokenizer from instead (e.g. 'en_core_web_md'),
+                  with all its components disabled
+    :return: a spaCy Language, or None
+    '''
+    groups, _ = select_features(features)
+    if not PARSE_GROUPS.intersection(groups):
+        return None
+    import spacy
+    if model is None:
+        return spacy.blank('en')
+    nlp = spacy.load(model)
+    nlp.select_pipes(disable=nlp.pipe_names)
+    return nlp
+
+
+def results_fingerprint(source, features=None, profile_columns=None, screening=None):
+    '''
+    a string identifying what the feature dicts depend on besides the essay: the source (None when the selected
+    features do not use it), the feature versions and the selected features (and the profile columns and the
+    screening thresholds, if any)
+    '''
+    groups, columns = select_features(features)
+    fingerprint = source.fingerprint if source is not None else ''
+    fingerprint += ''.join(f'/{group}-{FEATURE_VERSIONS[group]}' for group in groups)
+    if columns is not None:
+        fingerprint += '/' + ','.join(sorted(columns))
+    if profile_columns:
+        fingerprint += '/profile-' + ','.join(profile_columns)
+    if screening is not None and 'plagiarism' in groups:
+        fingerprint += '/screening-' + ','.join(map(repr, screening))
+    return fingerprint
+
+
+def doc_tokens(doc):
+    '''
+    Extract the token data the feature functions need from a spaCy Doc
+    :return: a list of Token, usable in place of the Doc
+    '''
+    return [Token(token.text, token.is_stop, token.is_punct) for token in doc]
+
+
+def text_chunks(text, chunk_length):
+    '''
+    Split a text into chunks of at most chunk_length characters, each ending with the whitespace after a
+    paragraph (or, in a longer paragraph, the whitespace between two words), so the chunks have the tokens of
+    the text: spaCy splits tokens at whitespace, and a run of whitespace stays whole in one chunk (only spaCy's
+    special cases matched across tokens, such as an emoticon next to the boundary, can differ)
+    :return: a generator of the chunks, which join to the text
+    '''
+    start = 0
+    while len(text) - start > chunk_length:
+        # (with the character after the chunk, which the boundaries look ahead to)
+        window = text[start:start + chunk_length + 1]
+        end = None
+        for boundary_pattern in (paragraph_boundary, whitespace_boundary):
+            for boundary in boundary_pattern.finditer(window):
+                end = boundary.end()
+            if end is not None:
+                break
+        if end is None:
+            # a single word fills the chunk: split before the whitespace after it (which may change how that
+            # whitespace is tokenized), or in the word if there is none
+            end = len(window[:chunk_length].rstrip()) or chunk_length
+        yield text[start:start + end]
+        start += end
+    yield text[start:]
+
+
+def parse_text(nlp, text, chunk_length=parse_chunk_length):
+    '''
+    Parse a text of any length: a text longer than chunk_length (or nlp.max_length, over which spaCy rejects a
+    text) is split into chunks at paragraph boundaries (see text_chunks), which are parsed one at a time with
+    nlp.pipe, and the token data of the chunks is joined, so the tokens, trigrams and runs of the features
+    cross the chunk boundaries as in the whole text
+    :return: the doc_tokens() of the text
+    '''
+    chunk_length = min(chunk_length, nlp.max_length)
+    if len(text) <= chunk_length:
+        return doc_tokens(nlp(text))
+    tokens = []
+    for doc in nlp.pipe(text_chunks(text, chunk_length), batch_size=1):
+        tokens.extend(doc_tokens(doc))
+    return tokens
+
+
+def parse_texts(nlp, items, batch_size=64, n_process=1, chunk_length=parse_chunk_length):
+    '''
+    Parse a stream of texts of any length with nlp.pipe (texts longer than chunk_length with parse_text)
+    :param items: an iterable of (text, context)
+    :return: a generator of (tokens, context), with the doc_tokens() of each text
+    '''
+    limit = min(chunk_length, nlp.max_length)
+    # the long texts pass through the pipe as empty texts, to keep the order of the items
+    texts = ((text if len(text) <= limit else '', (text, context)) for text, context in items)
+    for doc, (text, context) in nlp.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        yield (doc_tokens(doc) if len(text) <= limit else parse_text(nlp, text, chunk_length)), context
+
+
+def parse_version(nlp):
+    '''the version of the token data of a spaCy pipeline (for the cache)'''
+    import spacy
+    return f"{spacy.__version__}/{nlp.meta.get('lang')}_{nlp.meta.get('name')}-{nlp.meta.get('version')}"
+
+
+def group_features(group, text, text_doc, source, screening=None):
+    '''
+    Run an essay through the module of one feature group
+    :param screening: the Screening.Screening thresholds of the plagiarism features (None for the full features)
+    :return: the result dictionary of the module
+    '''
+    with stage(group):
+        if group == 'citation':
+            return citation_features(text)
+        if group == 'plagiarism':
+            return plagiarism_features(text, text_doc, source, screening=screening)
+        if group == 'quotation':
+            return quotation_features(text, text_doc, source)
+    raise ValueError(f'unknown feature group {group!r}')
+
+
+def essay_features(filename, text, text_doc, source):
+    '''
+    Run an essay through each module and merge the result dictionaries
+    :param text_doc: the spaCy Doc of the essay, or its doc_tokens()
+    :param source: a SourceIndex or SourceLibrary
+    :return: the feature dict of the essay, starting with its filename
+    '''
+    citation_result   = citation_features(text)
+    plagiarism_result = plagiarism_features(text, text_doc, source)
+    quotation_result  = quotation_features(text, text_doc, source)
+    merged_dict = {**citation_result, **plagiarism_result, **quotation_result}
+    return {'Filename': filename, **merged_dict}
+
+
+def _init_worker(source):
+    global _worker_source
+    _worker_source = source
+
+
+def _score_chunk(chunk, source=None, profile=False, memory=False, screening=None):
+    '''
+    score a chunk of (text, tokens, groups) tasks: the given feature groups of each essay
+    :return: a list of (results, stages): the result dictionary of each group, and the stage profile of the essay
+             (None unless profile is set; see Profiling)
+    '''
+    source = source if source is not None else _worker_source
+    if not profile:
+        # the plagiarism features of the chunk in one vectorized pass (see corpus_plagiarism_features)
+        plagiarism = [task for task in chunk if 'plagiarism' in task[2]]
+        corpus_results = iter(corpus_plagiarism_features([text for text, _, _ in plagiarism],
+                                                         [tokens for _, tokens, _ in plagiarism], source, screening))
+        return [({group: next(corpus_results) if group == 'plagiarism' else group_features(group, text, tokens, source)
+                  for group in groups}, None) for text, tokens, groups in chunk]
+    scored = []
+    for text, tokens, groups in chunk:
+        start_essay(memory)
+        results = {group: group_features(group, text, tokens, source, screening) for group in groups}
+        scored.append((results, finish_essay()))
+    return scored
+
+
+def _jobs(records, groups, source_keys, cache, token_version):
+    '''
+    look up each (filename, text) record in the cache
+    :return: a generator of job dicts: the filename, text, essay hash, cached token data and feature groups,
+             and the feature groups still to be computed
+    '''
+    for filename, text in records:
+        job = {'filename': filename, 'text': text, 'tokens': None, 'results': {}}
+        if cache is not None:
+            job['essay_hash'] = content_hash(text)
+            for group in groups:
+                result = cache.get(group, job['essay_hash'], source_keys.get(group, ''), FEATURE_VERSIONS[group])
+                if result is not None:
+                    job['results'][group] = result
+        job['missing'] = [group for group in groups if group not in job['results']]
+        if cache is not None and PARSE_GROUPS.intersection(job['missing']):
+            job['tokens'] = cache.get('tokens', job['essay_hash'], '', token_version)
+        job['parse'] = job['tokens'] is None and bool(PARSE_GROUPS.intersection(job['missing']))
+        yield job
+
+
+def _parsed_chunks(nlp, records, groups, source_keys, cache, batch_size, n_process, chunk_size, profile=False):
+    '''
+    parse the essays that need it with nlp.pipe (see parse_texts) and group the jobs into chunks
+    (essays that need no parse pass through the pipe as empty texts, to keep the order of the records)
+    With profile set, the time spent waiting for the Doc of each essay is its "parse" stage: with the default
+    tokenizer-only pipeline the pipe tokenizes one text at a time, so this is the parse of the essay itself
+    (pipelines with batched components attribute the time of a batch to its first essay).
+    '''
+    if nlp is None and PARSE_GROUPS.intersection(groups):
+        raise ValueError(f'the {", ".join(PARSE_GROUPS.intersection(groups))} features need a spaCy pipeline')
+    token_version = parse_version(nlp) if nlp is not None else None
+    jobs  = _jobs(records, groups, source_keys, cache, token_version)
+    if nlp is None:
+        docs = ((None, job) for job in jobs)
+    else:
+        texts = ((job['text'] if job['parse'] else '', job) for job in jobs)
+        docs  = parse_texts(nlp, texts, batch_size, n_process)
+
+    def parsed():
+        if profile:
+            docs_iter = iter(docs)
+            while True:
+                start = time.perf_counter()
+                try:
+                    tokens, job = next(docs_iter)
+                except StopIteration:
+                    return
+                if job['parse']:
+                    job['stages'] = {'parse': [time.perf_counter() - start, 0]}
+                    job['tokens'] = tokens
+                    if cache is not None:
+                        cache.put('tokens', job['essay_hash'], '', token_version, job['tokens'])
+                yield job
+        for tokens, job in docs:
+            if job['parse']:
+                job['tokens'] = tokens
+                if cache is not None:
+                    cache.put('tokens', job['essay_hash'], '', token_version, job['tokens'])
+            yield job
+
+    parsed_jobs = parsed()
+    while True:
+        chunk = list(islice(parsed_jobs, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _finish_chunk(chunk, computed, groups, columns, source_keys, cache, profiler=None):
+    '''
+    merge the cached and computed results of a chunk into feature dicts (of the selected columns, if any),
+    and cache the computed ones (and record the stage profiles of the essays with the profiler)
+    '''
+    for job, (results, stages) in zip(chunk, computed):
+        for group, result in results.items():
+            job['results'][group] = result
+            if cache is not None:
+                cache.put(group, job['essay_hash'], source_keys.get(group, ''), FEATURE_VERSIONS[group], result)
+        final_dict = {'Filename': job['filename']}
+        for group in groups:
+            if columns is None:
+                final_dict.update(job['results'][group])
+            else:
+                final_dict.update((column, value) for column, value in job['results'][group].items()
+                                  if column in columns)
+        if profiler is not None:
+            final_dict.update(profiler.record(job['filename'], {**job.get('stages', {}), **(stages or {})}))
+        yield final_dict
+
+
+def score_texts(nlp, records, source, batch_size=64, n_process=1, workers=1, chunk_size=16, cache=None,
+                features=None, profiler=None, screening=None):
+    '''
+    Score a stream of essays: the texts are parsed with nlp.pipe and the feature functions run in a pool of
+    worker processes. The source is sent to each worker once, when it starts, not with every essay.
+    :param nlp: the spaCy pipeline (see feature_pipeline; None if the selected features need no parse)
+    :param records: an iterable of (filename, text)
+    :param source: a SourceIndex or SourceLibrary (None if the selected features do not use the source)
+    :param batch_size: batch size of nlp.pipe
+    :param n_process: number of processes of nlp.pipe
+    :param workers: number of feature worker processes (1 scores in this process, None uses all cores)
+    :param chunk_size: number of essays sent to a worker at a time
+    :param cache: a FeatureCache; cached token data and feature groups of an essay are reused, and the
+                  computed ones are added to the cache
+    :param features: the feature groups and/or columns to compute (see select_features; None for all)
+    :param profiler: a Profiling.Profiler to record the time (and memory) of the stages of each essay, which
+                     adds its profile columns (if any) to the feature dicts
+    :param screening: the Screening.Screening thresholds, to compute the expensive plagiarism features only for
+                      the essays that reach one (None computes them for all essays)
+    :return: a generator of feature dicts (as essay_features, with the selected features), in the order of the records
+    '''
+    groups, columns = select_features(features)
+    if source is None and SOURCE_GROUPS.intersection(groups):
+        raise ValueError(f'the {", ".join(SOURCE_GROUPS.intersection(groups))} features need a source')
+    if screening is not None and columns is not None and 'plagiarism' in groups:
+        columns = columns.union(Plagiarism.SCREENING_COLUMNS)
+    # the cache key of the source of each feature group (the plagiarism features also depend on the screening)
+    source_keys = {}
+    if cache is not None and source is not None:
+        source_keys = {group: source.fingerprint for group in SOURCE_GROUPS}
+        if screening is not None:
+            source_keys['plagiarism'] += '/screening-' + ','.join(map(repr, screening))
+    profile = profiler is not None
+    memory  = profile and profiler.memory
+    chunks = _parsed_chunks(nlp, records, groups, source_keys, cache, batch_size, n_process, chunk_size, profile)
+
+    def tasks(chunk):
+        return [(job['text'], job['tokens'], job['missing']) for job in chunk]
+
+    if workers == 1:
+        for chunk in chunks:
+            computed = _score_chunk(tasks(chunk), source, profile, memory, screening)
+            yield from _finish_chunk(chunk, computed, groups, columns, source_keys, cache, profiler)
+        return
+
+    workers = workers or multiprocessing.cpu_count()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(source,)) as pool:
+        # keep a bounded number of chunks in flight, and collect them in submission order
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(_score_chunk, (tasks(chunk), None, profile, memory, screening))))
+            if len(pending) >= 2 * workers:
+                chunk, computed = pending.popleft()
+                yield from _finish_chunk(chunk, computed.get(), groups, columns, source_keys, cache, profiler)
+        while pending:
+            chunk, computed = pending.popleft()
+            yield from _finish_chunk(chunk, computed.get(), groups, columns, source_keys, cache, profiler)
@@ -0,0 +1,439 @@
+import os, re, sys, csv, json, math, time, random, tempfile, tracemalloc
+import pandas as pd
+from Citation import scan_citations, identify_citation, identify_citation_by_pattern, \
+    split_into_sentences, paragraph_spans, sentence_spans, citation_features
+from Plagiarism import SourceIndex, string_preprocessing, calculate_containment, containment_scores, get_tokens, \
+    LCS, plagiarism_features, corpus_containment_scores, corpus_plagiarism_features, essay_token_ids
+from Quotation import quotation_features
+from Batch import essay_features, doc_tokens, feature_pipeline
+from Revision import score_draft, draft_blocks
+from Results import ResultTable
+
+# words of the generated essays and sources (with stop words, which get_tokens drops)
+benchmark_words = ("the a of and to in is that it was for on are as with they at be this from have or by one had "
+                   "not but what all were when we there can an which their said if do will each about how up out "
+                   "them then she many some so these would other into has more two like see time could no make "
+                   "than first been its who now people made over did down only way find use may water long little "
+                   "very after words called just where most know get through back much before go good new write "
+                   "our used man too any day same right look think also around another came come work three word "
+                   "must because does part even place well such here take why things help put years different "
+                   "away again off went old number great tell men say small every found still between name should "
+                   "home big give air line set own under read last never left end along while might next sound "
+                   "below saw something thought both few those always show large often together asked house world "
+                   "going want school important until form food keep children land side without once animals life "
+                   "enough took sometimes head above kind began almost live page got earth need far hand high year "
+                   "mother light country father let night following picture being study second eyes soon story "
+                   "since white days ever paper hard near sentence better best across during today sure means knew "
+                   "try told young sun ways thing whole hear example heard several change answer room sea against "
+                   "top turned learn point city play toward five using usually").split()
+# citations of the generated essays (of each citation pattern, and some that the filters drop)
+benchmark_citations = ["Source A", "(Source B)", "source 1 ", "(Text 2)", "(Smith et al., 2019)", "(Jones, 2020)",
+                       "Article C", "the Passage D", "(Report E)", "Essay 3 ", "I A ", "Study F"]
+
+
+def time_function(function, *args, repeat=5):
+    '''
+    Time a function call
+    :return: the best wall time of repeat calls, in seconds
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_citation_scanner(texts, repeat=5):
+    '''
+    Time finding the citations of essays: the six findall passes of identify_citation_by_pattern, which
+    citation_features used to run three times per essay (for the word position, character position and coverage
+    features), against the single scan_citations() pass they now share. Also checks that both find the same citations.
+    :param texts: a list of essay texts
+    :return: a dict of the total times in seconds, the speedup and the number of essays with different citations
+    '''
+    def by_pattern():
+        for text in texts:
+            for _ in range(3):
+                identify_citation_by_pattern(text)
+
+    def scanner():
+        for text in texts:
+            scan_citations(text)
+
+    mismatches = sum(identify_citation(text) != identify_citation_by_pattern(text) for text in texts)
+    by_pattern_time = time_function(by_pattern, repeat=repeat)
+    scanner_time = time_function(scanner, repeat=repeat)
+    return {'by_pattern_seconds': by_pattern_time,
+            'scanner_seconds':    scanner_time,
+            'speedup':            by_pattern_time / scanner_time if scanner_time else float('inf'),
+            'mismatches':         mismatches}
+
+
+def benchmark_segmenter(texts, repeat=5):
+    '''
+    Time splitting essays into paragraphs and sentences: split_into_sentences on each stripped line, against
+    paragraph_spans and sentence_spans. Also checks that both find the same sentences; split_into_sentences moves
+    closing quotes and turns whitespace into spaces, so the sentences are compared without spaces, quotes and . ! ?
+    :param texts: a list of essay texts
+    :return: a dict of the total times in seconds, the speedup and the number of essays with different sentences
+    '''
+    def rewriting(text):
+        return [split_into_sentences(para.strip()) for para in filter(bool, text.splitlines())]
+
+    def spans(text):
+        return [sentence_spans(text, start, end) for start, end in paragraph_spans(text)]
+
+    def comparable(sentence):
+        return re.sub(r'[\s"”.!?]', '', sentence)
+
+    mismatches = 0
+    for text in texts:
+        old = [[comparable(sentence) for sentence in para] for para in rewriting(text)]
+        new = [[comparable(text[start:end]) for start, end in para] for para in spans(text)]
+        mismatches += old != new
+    rewriting_time = time_function(lambda: [rewriting(text) for text in texts], repeat=repeat)
+    spans_time     = time_function(lambda: [spans(text) for text in texts], repeat=repeat)
+    return {'split_into_sentences_seconds': rewriting_time,
+            'sentence_spans_seconds':       spans_time,
+            'speedup':                      rewriting_time / spans_time if spans_time else float('inf'),
+            'mismatches':                   mismatches}
+
+
+def generate_source(seed, n_tokens=1000):
+    '''
+    Generate a source text of random sentences and paragraphs
+    :param seed: the random seed (the same seed gives the same text)
+    :param n_tokens: the approximate number of words
+    :return: the source text
+    '''
+    rand = random.Random(seed)
+    paragraphs, sentences, length = [], [], 0
+    while length < n_tokens:
+        words = [rand.choice(benchmark_words) for _ in range(rand.randint(5, 20))]
+        length += len(words)
+        sentences.append(' '.join(words).capitalize() + rand.choice(['.', '.', '.', '?', '!']))
+        if rand.random() < 0.2:
+            paragraphs.append(' '.join(sentences))
+            sentences = []
+    paragraphs.append(' '.join(sentences))
+    return '\n\n'.join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def generate_essay(seed, source, n_tokens=500, citation_density=0.2, quote_density=0.1, copy_ratio=0.2):
+    '''
+    Generate an essay on a source text
+    :param seed: the random seed (the same seed gives the same essay)
+    :param source: the source text
+    :param n_tokens: the approximate number of words
+    :param citation_density: the share of sentences with a citation
+    :param quote_density: the share of sentences with a quotation from the source (in straight or curly quotes,
+                          some of them in upper case)
+    :param copy_ratio: the share of sentences copied from the source
+    :return: the essay text
+    '''
+    rand = random.Random(seed)
+    source_words = source.split()
+    paragraphs, sentences, length = [], [], 0
+    while length < n_tokens:
+        if rand.random() < copy_ratio:
+            start = rand.randrange(max(1, len(source_words) - 20))
+            words = source_words[start:start + rand.randint(5, 20)]
+        else:
+            words = [rand.choice(benchmark_words) for _ in range(rand.randint(5, 20))]
+        length += len(words)
+        sentence = ' '.join(words).capitalize()
+        if rand.random() < citation_density:
+            citation = rand.choice(benchmark_citations)
+            sentence = citation + ' ' + sentence if rand.random() < 0.5 else sentence + ' ' + citation
+        if rand.random() < quote_density:
+            start = rand.randrange(max(1, len(source_words) - 10))
+            quotation = ' '.join(source_words[start:start + rand.randint(2, 8)])
+            if rand.random() < 0.3:
+                quotation = quotation.upper()
+            sentence += ' “' + quotation + '”' if rand.random() < 0.3 else ' "' + quotation + '"'
+        sentences.append(sentence + rand.choice(['.', '.', '.', '?', '!']))
+        if rand.random() < 0.2:
+            paragraphs.append(' '.join(sentences))
+            sentences = []
+    paragraphs.append(' '.join(sentences))
+    return '\n\n'.join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def peak_memory(function, *args):
+    '''
+    :return: the peak memory allocated during a function call, in bytes
+    '''
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_scaling(sizes=(200, 1000, 5000, 20000), source_tokens=2000, seed=0, repeat=3, reference_limit=5000):
+    '''
+    Time each feature function, its original (reference) implementation where it has one, and the whole
+    scoring of an essay, on generated essays of increasing length, and measure their peak memory
+    :param sizes: the essay lengths in words
+    :param source_tokens: the length of the generated source in words
+    :param reference_limit: the longest essay the reference implementations run on (LCS is quadratic)
+    :return: a list of dicts of the essay length, function, best time in seconds and peak memory in bytes
+    '''
+    nlp = feature_pipeline()
+    source = generate_source(seed, source_tokens)
+    index  = SourceIndex(source, nlp(source))
+    rows = []
+    for size in sizes:
+        essay = generate_essay(seed + size, source, size)
+        essay_doc = doc_tokens(nlp(essay))
+        essay_text, essay_tokens = string_preprocessing(essay), get_tokens(essay_doc)
+        essay_ids = essay_token_ids(essay_tokens, index.token_vocabulary)
+        # (name, function, whether it is a reference implementation)
+        cases = [('split_into_sentences', lambda: [split_into_sentences(para.strip())
+                                                   for para in filter(bool, essay.splitlines())], True),
+                 ('sentence_spans', lambda: [sentence_spans(essay, start, end)
+                                             for start, end in paragraph_spans(essay)], False),
+                 ('identify_citation_by_pattern', lambda: identify_citation_by_pattern(essay), True),
+                 ('scan_citations', lambda: scan_citations(essay), False),
+                 ('calculate_containment', lambda: [calculate_containment(n, essay_text, index.preprocessed)
+                                                    for n in index.ngram_range], True),
+                 ('containment_scores', lambda: containment_scores(essay_text, index), False),
+                 ('LCS', lambda: LCS(index.tokens, essay_tokens), True),
+                 ('longest_common_run', lambda: index.automaton.longest_common_run(essay_ids), False),
+                 ('SpanIndex.align', lambda: index.spans.align(essay), False),
+                 ('citation_features', lambda: citation_features(essay), False),
+                 ('plagiarism_features', lambda: plagiarism_features(essay, essay_doc, index), False),
+                 ('quotation_features', lambda: quotation_features(essay, essay_doc, index), False),
+                 ('tokenize', lambda: nlp(essay), False),
+                 ('essay_features', lambda: essay_features('essay', essay, doc_tokens(nlp(essay)), index), False)]
+        for name, function, reference in cases:
+            if reference and size > reference_limit:
+                continue
+            rows.append({'tokens':     size,
+                         'function':   name,
+                         'seconds':    time_function(function, repeat=repeat),
+                         'peak_bytes': peak_memory(function)})
+    return rows
+
+
+def golden_corpus(seed=0, essays=24):
+    '''
+    Generate the essays of the golden-output check, with a range of lengths, citation and quote densities
+    and copy ratios
+    :return: (source, {filename: essay})
+    '''
+    source = generate_source(seed, 1500)
+    texts = {}
+    for number in range(essays):
+        texts[f'essay_{number:03d}'] = generate_essay(seed + number, source, n_tokens=100 + 60 * number,
+                                                      citation_density=(number % 4) / 4,
+                                                      quote_density=(number % 3) / 4,
+                                                      copy_ratio=(number % 5) / 5)
+    return source, texts
+
+
+def golden_check(golden_path, seed=0):
+    '''
+    Score the golden corpus and compare every feature column with the values saved in golden_path, to check
+    that a change (e.g. a faster code path) reproduces the feature values; the values are saved there if the
+    file does not exist yet
+    :return: a list of (filename, column, saved value, current value) of the values that differ
+    '''
+    nlp = feature_pipeline()
+    source, texts = golden_corpus(seed)
+    index = SourceIndex(source, nlp(source))
+    current = {filename: essay_features(filename, text, doc_tokens(nlp(text)), index)
+               for filename, text in texts.items()}
+    if not os.path.exists(golden_path):
+        with open(golden_path, 'w', encoding='utf-8') as file:
+            json.dump(current, file, indent=1)
+        return []
+
+    def same(saved, value):
+        if isinstance(saved, float) and isinstance(value, float):
+            return saved == value or (math.isnan(saved) and math.isnan(value))
+        return saved == value
+
+    with open(golden_path, 'r', encoding='utf-8') as file:
+        golden = json.load(file)
+    differences = []
+    for filename, saved_dict in golden.items():
+        current_dict = current.get(filename, {})
+        for column, saved in saved_dict.items():
+            if column not in current_dict or not same(saved, current_dict[column]):
+                differences.append((filename, column, saved, current_dict.get(column)))
+    return differences
+
+
+def reference_check(seed=0):
+    '''
+    Check the faster code paths against the original implementations on the golden corpus
+    :return: a dict of the number of essays where each faster path differs from its reference
+    '''
+    nlp = feature_pipeline()
+    source, texts = golden_corpus(seed)
+    index = SourceIndex(source, nlp(source))
+    mismatches = {'containment_scores': 0, 'longest_common_run': 0, 'scan_citations': 0, 'sentence_spans': 0,
+                  'corpus_plagiarism_features': 0, 'score_draft': 0}
+    for text in texts.values():
+        essay_text, essay_tokens = string_preprocessing(text), get_tokens(nlp(text))
+        scores = containment_scores(essay_text, index)
+        for n in index.ngram_range:
+            reference = calculate_containment(n, essay_text, index.preprocessed)
+            if not (scores[n] == reference or (math.isnan(scores[n]) and math.isnan(reference))):
+                mismatches['containment_scores'] += 1
+                break
+        essay_ids = essay_token_ids(essay_tokens, index.token_vocabulary)
+        mismatches['longest_common_run'] += index.automaton.longest_common_run(essay_ids) != \
+            LCS(index.tokens, essay_tokens)
+        mismatches['scan_citations'] += identify_citation(text) != identify_citation_by_pattern(text)
+        mismatches['sentence_spans'] += benchmark_segmenter([text], repeat=1)['mismatches']
+    docs = [doc_tokens(nlp(text)) for text in texts.values()]
+    for text, doc, corpus_dict in zip(texts.values(), docs, corpus_plagiarism_features(list(texts.values()), docs,
+                                                                                        index)):
+        essay_dict = plagiarism_features(text, doc, index)
+        mismatches['corpus_plagiarism_features'] += any(
+            not (value == corpus_dict[column] or (isinstance(value, float) and math.isnan(value)
+                                                  and math.isnan(corpus_dict[column])))
+            or type(value) != type(corpus_dict[column]) for column, value in essay_dict.items())
+        # the essay scored as a revision of a draft without its last block, and with a new first paragraph
+        blocks = draft_blocks(text)
+        draft  = score_draft('essay', ''.join(blocks[:-1]), nlp, index)
+        for revision in (text, 'A new first paragraph (Source A).\n\n' + text):
+            draft = draft.revise(revision, nlp)
+            mismatches['score_draft'] += not same_features(draft.features,
+                                                           essay_features('essay', revision, nlp(revision), index))
+    return mismatches
+
+
+def same_features(first, second):
+    '''whether two feature dicts have the same columns and values (nan equal to nan)'''
+    return list(first) == list(second) and all(
+        value == second[column] or (isinstance(value, float) and math.isnan(value) and math.isnan(second[column]))
+        for column, value in first.items())
+
+
+def benchmark_revisions(drafts=8, essay_tokens=2000, source_tokens=2000, seed=0):
+    '''
+    Time the scoring of the drafts of a generated essay, each revising one paragraph of the previous one, from
+    scratch (parse and essay_features) and as a revision of the previous draft (score_draft)
+    :return: a dict of the average times per draft in seconds, and the number of drafts with different features
+    '''
+    nlp = feature_pipeline()
+    source = generate_source(seed, source_tokens)
+    index  = SourceIndex(source, nlp(source))
+    rand   = random.Random(seed)
+    blocks = draft_blocks(generate_essay(seed, source, essay_tokens, citation_density=0.3))
+    texts  = [''.join(blocks)]
+    for number in range(drafts - 1):
+        revised = rand.randrange(len(blocks))
+        blocks[revised] = generate_essay(seed + number + 1, source, 40) + ' ' + blocks[revised]
+        texts.append(''.join(blocks))
+
+    full_seconds, revision_seconds, mismatches = 0.0, 0.0, 0
+    draft = score_draft('essay', texts[0], nlp, index)
+    for text in texts[1:]:
+        start = time.perf_counter()
+        features = essay_features('essay', text, doc_tokens(nlp(text)), index)
+        full_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        draft = draft.revise(text, nlp)
+        revision_seconds += time.perf_counter() - start
+        mismatches += not same_features(draft.features, features)
+    return {'essay_features_seconds': full_seconds / (drafts - 1),
+            'score_draft_seconds':    revision_seconds / (drafts - 1),
+            'mismatches':             mismatches}
+
+
+def benchmark_corpus(essays=2000, essay_tokens=500, source_tokens=2000, seed=0):
+    '''
+    Time the containment scores and plagiarism features of a generated corpus essay by essay and for the whole
+    corpus at once (corpus_containment_scores, corpus_plagiarism_features)
+    :return: a dict of the times in seconds
+    '''
+    nlp = feature_pipeline()
+    source = generate_source(seed, source_tokens)
+    index  = SourceIndex(source, nlp(source))
+    texts  = [generate_essay(seed + number, source, essay_tokens) for number in range(essays)]
+    docs   = [doc_tokens(nlp(text)) for text in texts]
+    essay_texts = [string_preprocessing(text) for text in texts]
+    return {'containment_scores_seconds':
+                time_function(lambda: [containment_scores(essay_text, index) for essay_text in essay_texts], repeat=1),
+            'corpus_containment_scores_seconds':
+                time_function(lambda: corpus_containment_scores(essay_texts, index), repeat=1),
+            'plagiarism_features_seconds':
+                time_function(lambda: [plagiarism_features(text, doc, index) for text, doc in zip(texts, docs)],
+                              repeat=1),
+            'corpus_plagiarism_features_seconds':
+                time_function(lambda: corpus_plagiarism_features(texts, docs, index), repeat=1)}
+
+
+def benchmark_results(rows=200000, essays=200, essay_tokens=500, source_tokens=2000, seed=0):
+    '''
+    Time loading the results of a large run from the output CSV file, and from the Parquet and Arrow files of a
+    ResultTable: the feature dicts of a generated corpus, repeated to the given number of rows
+    :return: a dict of the times in seconds
+    '''
+    nlp = feature_pipeline()
+    source = generate_source(seed, source_tokens)
+    index  = SourceIndex(source, nlp(source))
+    scored = [essay_features(f'essay{number}', text, nlp(text), index) for number, text in
+              enumerate(generate_essay(seed + number, source, essay_tokens) for number in range(essays))]
+    result_dicts = [{**scored[number % essays], 'Filename': f'essay{number}.txt'} for number in range(rows)]
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {extension: os.path.join(folder, 'results.' + extension) for extension in ('csv', 'parquet', 'arrow')}
+        with open(paths['csv'], 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(result_dicts[0]))
+            writer.writeheader()
+            writer.writerows(result_dicts)
+        table = ResultTable()
+        results = {'append_seconds': time_function(lambda: table.extend(result_dicts), repeat=1)}
+        table.write(paths['parquet'])
+        table.write(paths['arrow'])
+        results.update({'csv_read_seconds':       time_function(lambda: pd.read_csv(paths['csv']), repeat=1),
+                        'csv_typed_read_seconds': time_function(lambda: ResultTable.from_csv(paths['csv']), repeat=1),
+                        'parquet_read_seconds':   time_function(lambda: pd.read_parquet(paths['parquet']), repeat=1),
+                        'arrow_read_seconds':     time_function(lambda: pd.read_feather(paths['arrow']), repeat=1)})
+    return results
+
+
+def read_texts(folder_path):
+    texts = []
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.endswith('.txt'):
+            with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as file:
+                texts.append(file.read())
+    return texts
+
+
+if __name__ == '__main__':
+    # Usage: python Benchmark.py path/to/texts_folder   (the faster code paths against the original ones)
+    #        python Benchmark.py --sweep               (timings and peak memory on generated essays of 200-20k words)
+    #        python Benchmark.py --golden golden.json  (feature values of generated essays against a saved copy)
+    #        python Benchmark.py --corpus              (essay-by-essay against whole-corpus plagiarism features)
+    #        python Benchmark.py --revisions           (drafts scored from scratch against scored as revisions)
+    #        python Benchmark.py --results             (loading 200k result rows from CSV, Parquet and Arrow)
+    if sys.argv[1] == '--sweep':
+        print(f"{'words':>6}  {'function':<30}{'seconds':>10}{'peak MB':>10}")
+        for row in benchmark_scaling():
+            print(f"{row['tokens']:>6}  {row['function']:<30}{row['seconds']:>10.4f}"
+                  f"{row['peak_bytes'] / 2 ** 20:>10.2f}")
+    elif sys.argv[1] == '--golden':
+        print('Faster paths against the original implementations (mismatches):', reference_check())
+        differences = golden_check(sys.argv[2])
+        for filename, column, saved, value in differences:
+            print(f'{filename} {column}: {saved!r} (saved) != {value!r}')
+        print(f'Golden output: {len(differences)} differences')
+    elif sys.argv[1] == '--corpus':
+        print('Plagiarism features of 2000 generated essays:', benchmark_corpus())
+    elif sys.argv[1] == '--revisions':
+        for essay_tokens in (500, 2000, 10000):
+            print(f'Drafts of a {essay_tokens}-word essay:', benchmark_revisions(essay_tokens=essay_tokens))
+    elif sys.argv[1] == '--results':
+        print('200k result rows:', benchmark_results())
+    else:
+        texts = read_texts(sys.argv[1])
+        print('Citation scanner:', benchmark_citation_scanner(texts))
+        print('Sentence segmenter:', benchmark_segmenter(texts))
@@ -0,0 +1,99 @@
+import time, pickle, sqlite3
+
+
+class FeatureCache:
+    '''
+    A persistent cache of per-essay results in an SQLite file, so essays that are scored again (in reruns,
+    rubric experiments, or against a new source) do not repeat the spaCy parse or unchanged feature groups.
+
+    Entries are keyed by (group, essay hash, source hash, version): the group is "tokens" (the parsed token
+    data) or a feature group ("citation", "plagiarism", "quotation"), and the version is that of the module
+    (or spaCy model) computing it. Groups that do not depend on the source (tokens, citation) are stored with
+    an empty source hash, so a new source only misses the plagiarism and quotation entries.
+    When the values take more than max_bytes, the least recently used entries are evicted.
+    '''
+
+    def __init__(self, path, max_bytes=1 << 30):
+        '''
+        :param path: path of the SQLite file (created if it does not exist)
+        :param max_bytes: size limit of the cached values
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits   = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                        feature_group TEXT, essay_hash TEXT, source_hash TEXT, version TEXT,
+                                        value BLOB, size INTEGER, last_used REAL,
+                                        PRIMARY KEY (feature_group, essay_hash, source_hash, version))''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self._connection.commit()
+        self.total_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        self._uncommitted = 0
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+            self._connection.commit()
+
+    def get(self, group, essay_hash, source_hash, version):
+        '''
+        :return: the cached value, or None if it is not in the cache
+        '''
+        key = (group, essay_hash, source_hash, str(version))
+        row = self._connection.execute('''SELECT value FROM entries WHERE feature_group = ? AND essay_hash = ?
+                                          AND source_hash = ? AND version = ?''', key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._connection.execute('''UPDATE entries SET last_used = ? WHERE feature_group = ? AND essay_hash = ?
+                                    AND source_hash = ? AND version = ?''', (time.time(),) + key)
+        self._changed()
+        return pickle.loads(row[0])
+
+    def put(self, group, essay_hash, source_hash, version, value):
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        key = (group, essay_hash, source_hash, str(version))
+        old = self._connection.execute('''SELECT size FROM entries WHERE feature_group = ? AND essay_hash = ?
+                                          AND source_hash = ? AND version = ?''', key).fetchone()
+        self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 key + (value, len(value), time.time()))
+        self.total_bytes += len(value) - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        self._changed()
+
+    def _evict(self):
+        # delete the least recently used entries until the cache is back under its size limit
+        while self.total_bytes > self.max_bytes:
+            rows = self._connection.execute('SELECT rowid, size FROM entries ORDER BY last_used LIMIT 100').fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for rowid, size in rows:
+                self._connection.execute('DELETE FROM entries WHERE rowid = ?', (rowid,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def _changed(self):
+        # commit in batches rather than after every lookup
+        self._uncommitted += 1
+        if self._uncommitted >= 100:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def clear(self):
+        self._connection.execute('DELETE FROM entries')
+        self._connection.commit()
+        self.total_bytes = 0
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,12 +1,32 @@
 import re, string
 import numpy as np
-from collections import Counter
+from bisect import bisect_left
+from collections import Counter, namedtuple
 from statistics import mean, stdev
+from Profiling import stage
+
+punctuation_table = str.maketrans('', '', string.punctuation)
+
+# Version of the features of this module; increase it when a change alters their values (invalidates cached results)
+FEATURE_VERSION = 2
+# The columns of citation_features
+FEATURE_COLUMNS = ['average_raw_citation_sentence_location_in_essay', 'sd_raw_citation_sentence_location_in_essay',
+                   'average_norm_citation_sentence_location_in_essay', 'sd_norm_citation_sentence_location_in_essay',
+                   'average_raw_citation_sentence_location_in_para', 'sd_raw_citation_sentence_location_in_para',
+                   'average_norm_citation_sentence_location_in_para', 'sd_norm_citation_sentence_location_in_para',
+                   'percentage_of_paragraphs_with_citations', 'average_citation_word_location_in_essay',
+                   'sd_citation_word_location_in_essay', 'average_citation_character_location_in_essay',
+                   'sd_citation_character_location_in_essay', 'count_of_citations', 'frequency_of_citations',
+                   'percent_most_common_cited_source', 'number_of_unique_citations']
+# The dtypes of the columns in a typed result table (see Results.ResultTable)
+FEATURE_DTYPES = dict.fromkeys(FEATURE_COLUMNS, 'float64')
+FEATURE_DTYPES.update({'count_of_citations': 'int32', 'number_of_unique_citations': 'int32'})
 
 
 def split_into_sentences(text):
     '''
     This function tokenize a string into sentences
+    (build_sent_dict uses sentence_spans, which finds the same sentences with their positions)
     :param text: a string
     :return: sentences: a list of sentences
     '''
@@ -50,16 +70,249 @@ def split_into_sentences(text):
     return sentences
 
 
-def identify_citation(target):
+# The rules of split_into_sentences, for the offset-preserving segmenter (sentence_spans)
+sentence_prefixes = ("Mr", "St", "Mrs", "Ms", "Dr", "Prof", "Capt", "Cpt", "Lt", "Mt")    # Dr. (not an end)
+sentence_suffixes = (" Inc", " Ltd", " Jr", " Sr", " Co")                                  # Inc. (not an end)
+sentence_websites = ("com", "net", "org", "io", "gov", "me", "edu")                        # .com (not an end)
+sentence_starters = re.compile(r"Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|"
+                               r"This\s|Wherever")  # words that start a sentence after an acronym or a suffix
+sentence_punctuation = re.compile(r'[.!?"”]+')
+# the lines of a text, as str.splitlines() splits it
+paragraph_lines = re.compile(r"[^\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]+")
+
+
+def paragraph_spans(content):
+    '''
+    This function finds the paragraphs of an essay as build_sent_dict takes them: the non-empty lines, stripped
+    :return: a list of (start, end) of the paragraphs in content
+    '''
+    spans = []
+    for line in paragraph_lines.finditer(content):
+        start, end = line.span()
+        while start < end and content[start].isspace():
+            start += 1
+        while end > start and content[end - 1].isspace():
+            end -= 1
+        spans.append((start, end))
+    return spans
+
+
+def sentence_spans(content, start=0, end=None):
+    '''
+    This function finds the sentences of a text like split_into_sentences, with the same abbreviation, acronym,
+    website and quote rules, but in one pass over its punctuation instead of rewriting the text, and it returns
+    where the sentences are rather than copies of them.
+    :param content: a string
+    :param start, end: the part of content to split (e.g. a paragraph from paragraph_spans)
+    :return: a list of (start, end) of the sentences in content
+    '''
+    letters, uppercase = string.ascii_letters, string.ascii_uppercase
+    # the text is padded as in split_into_sentences, so the positions below are one more than in the text
+    text = (" " + content[start:end] + "  ").replace("\n", " ")
+    offset = start - 1
+    runs = [match.span() for match in sentence_punctuation.finditer(text)]
+    dots = [x for run_start, run_end in runs for x in range(run_start, run_end) if text[x] == '.']
+
+    # dots that do not end a sentence: after a prefix (Dr.), before a website domain (.com), in Ph.D.,
+    # and after a single letter between spaces (J. K. Rowling)
+    protected = set()
+    for x in dots:
+        if text.endswith(sentence_prefixes, 0, x) or text.startswith(sentence_websites, x + 1):
+            protected.add(x)
+        elif text[x - 1] in letters:
+            if x >= 2 and text[x - 2].isspace() and text[x + 1] == ' ':
+                protected.add(x)
+            elif text.startswith("Ph.D.", x - 2) and not text.startswith(sentence_websites, x + 3):
+                protected.update((x, x + 2))
+
+    def letter_dot(x, letters):
+        return x >= 1 and text[x] == '.' and x not in protected and text[x - 1] in letters
+
+    # the sentence ends besides the remaining dots, ! and ?, as (end of a sentence, start of the next one)
+    stops = []
+    # an acronym followed by a sentence starter ends a sentence (U.S. He); like the regex of split_into_sentences,
+    # a match does not overlap the previous one
+    matched_until = 0
+    for x in dots:
+        if text[x + 1] != ' ' or not (letter_dot(x, uppercase) and letter_dot(x - 2, uppercase)):
+            continue
+        starter = sentence_starters.match(text, x + 2)
+        if starter is None:
+            continue
+        three_letters = letter_dot(x - 4, uppercase) and x - 5 >= matched_until
+        if three_letters or x - 3 >= matched_until:
+            stops.append((x + 1, x + 1))
+            matched_until = starter.end()
+
+    # dots of runs of single letters (e.g., U.S.A., e.g.): split_into_sentences protects them in groups of three,
+    # then of two, so the last dot of a run of 4, 7, ... letters still ends a sentence
+    def protect_run(run):
+        if len(run) >= 2:
+            protected.update(run[:-1] if len(run) % 3 == 1 else run)
+
+    run = []
+    for x in dots:
+        if text[x - 1] not in letters or x in protected:
+            continue
+        if run and x == run[-1] + 2:
+            run.append(x)
+        else:
+            protect_run(run)
+            run = [x]
+    protect_run(run)
+
+    # after a suffix, a dot followed by a sentence starter ends the sentence and is dropped (Apple Inc. He);
+    # other dots after a suffix or a single letter do not end a sentence
+    removed = set()
+    matched_until = 0
+    for x in dots:
+        if x in protected:
+            continue
+        if text.endswith(sentence_suffixes, 0, x):
+            suffix_start = x - len(next(suffix for suffix in sentence_suffixes if text.endswith(suffix, 0, x)))
+            starter = sentence_starters.match(text, x + 2) if text[x + 1] == ' ' else None
+            if starter is not None and suffix_start >= matched_until:
+                removed.add(x)
+                stops.append((x, x + 1))
+                matched_until = starter.end()
+            else:
+                protected.add(x)
+        elif x >= 2 and text[x - 2] == ' ' and text[x - 1] in letters:
+            protected.add(x)
+
+    # the remaining punctuation: split_into_sentences moves a closing quote before the . ! or ? in front of it,
+    # and "..." does not end a sentence; both are replayed on each cluster of punctuation and quotes
+    for run_start, run_end in runs:
+        if run_end - run_start == 1:
+            if text[run_start] in '!?' or (text[run_start] == '.' and run_start not in protected
+                                           and run_start not in removed):
+                stops.append((run_end, run_end))
+            continue
+        cluster = []
+        for x in range(run_start, run_end + 1):
+            if x < run_end and x not in protected and x not in removed:
+                if not cluster:
+                    cluster_start = x
+                cluster.append(text[x])
+                continue
+            for mark, quote in (('.', '”'), ('.', '"'), ('!', '"'), ('?', '"')):
+                i = 0
+                while i < len(cluster) - 1:
+                    if cluster[i] == mark and cluster[i + 1] == quote:
+                        cluster[i], cluster[i + 1] = quote, mark
+                        i += 2
+                    else:
+                        i += 1
+            i = 0
+            while i < len(cluster):
+                if cluster[i:i + 3] == ['.', '.', '.']:
+                    i += 3
+                    continue
+                if cluster[i] in '.!?':
+                    # the cluster is contiguous: the sentence takes its first i + 1 characters
+                    stops.append((cluster_start + i + 1, cluster_start + i + 1))
+                i += 1
+            cluster = []
+
+    # the sentences between the ends: the text after the last end is dropped, and a text without any end
+    # is one sentence; sentences of less than three characters are dropped
+    if stops:
+        stops.sort()
+        pieces = []
+        piece_start = 0
+        for stop, next_start in stops:
+            pieces.append((piece_start, max(stop, piece_start)))
+            piece_start = max(next_start, piece_start)
+    else:
+        pieces = [(0, len(text))]
+    spans = []
+    for piece_start, piece_end in pieces:
+        while piece_start < piece_end and text[piece_start].isspace():
+            piece_start += 1
+        while piece_end > piece_start and text[piece_end - 1].isspace():
+            piece_end -= 1
+        if piece_end - piece_start > 2:
+            spans.append((piece_start + offset, piece_end + offset))
+    return spans
+
+
+# keywords that a citation of patterns 1-4 has to start with
+keywords = ["source", "text", "article", "essay", "report", "blog", "post", "book", "chapter", "editorial",
+            "excerpt", "interview", "journal", "lecture", "magazine", "newspaper", "paper", "passage",
+            "quote", "research", "study", "speech", "website"]
+
+# the citation patterns
+expression_1 = re.compile(r"([a-zA-Z]+ [A-Z]) ")  # Letters A-Z
+expression_2 = re.compile(r"\([a-zA-Z]+\s[0-9]+\)", re.IGNORECASE)  # (Letters 0-9)
+expression_3 = re.compile(r"([a-zA-Z]+\s[0-9] )", re.IGNORECASE)  # Letters 0-9
+expression_4 = re.compile(r"\([a-zA-Z]+ [A-Z]\)", re.IGNORECASE)  # (Letters A-Z)
+expression_5 = re.compile(r"\([a-zA-Z]+ et al\., \d{4}\)", re.IGNORECASE)  # (Letters et al., 4-digit number)
+expression_6 = re.compile(r"\([a-zA-Z]+, \d{4}\)", re.IGNORECASE)  # (Letters, 4-digit number)
+
+# All six patterns in one scanner, which stops only where a citation starts: at the start of a run of letters
+# (patterns 1 and 3, where findall finds them) or at an opening parenthesis (patterns 2, 4, 5 and 6).
+# It consumes just that run or parenthesis and looks ahead for the rest of the citation ("r<n>" for pattern n),
+# so citations that overlap (e.g. "Source A 1 " for patterns 1 and 3) are all found.
+citation_scanner = re.compile(r"""(?<![a-zA-Z])(?=(?P<w1>[a-zA-Z]+))(?P=w1)(?=(?P<r1>\ [A-Z]\ ))
+                                 |(?i:(?<![a-z])(?=(?P<w3>[a-z]+))(?P=w3)(?=(?P<r3>\s[0-9]\ )))
+                                 |\((?=(?P<r2>(?i:[a-zA-Z]+\s[0-9]+\)))
+                                      |(?P<r4>(?i:[a-zA-Z]+\ [A-Z]\)))
+                                      |(?P<r5>(?i:[a-zA-Z]+\ et\ al\.,\ \d{4}\)))
+                                      |(?P<r6>(?i:[a-zA-Z]+,\ \d{4}\))))""", re.VERBOSE)
+
+# a citation found in a text: its span (of the whole pattern match), the number of the pattern (1-6),
+# the citation text (as identify_citation returns it) and its first word in lower case
+CitationMatch = namedtuple('CitationMatch', ['start', 'end', 'pattern', 'text', 'keyword'])
+
+
+def scan_citations(target):
+    '''
+    This function finds all citations in a text in one pass, with the same patterns and filters as identify_citation
+    :return: a list of CitationMatch, in text order
+    '''
+    citations = []
+    # end of the last match of each pattern: like findall, matches of the same pattern do not overlap
+    last_end = [0] * 7
+    for match in citation_scanner.finditer(target):
+        pattern = int(match.lastgroup[1:])
+        start, end = match.start(), match.end(match.lastgroup)
+        if start < last_end[pattern]:
+            continue
+        last_end[pattern] = end
+        # the citation text of pattern 1 is without its trailing space
+        text = target[start:end - 1] if pattern == 1 else target[start:end]
+        words = text.split()
+        # filter 1: the second word is not "I"
+        if words[1] == "I":
+            continue
+        keyword = text.translate(punctuation_table).split()[0].lower()
+        # filter 2: patterns 1-4 start with a keyword
+        if pattern <= 4 and keyword not in keywords:
+            continue
+        citations.append(CitationMatch(start, end, pattern, text, keyword))
+    return citations
+
+
+def identify_citation(target, citations=None):
     '''
     This function identify citations according to fixed format (e.g., Source A, (Source A))
     or keywords from the source text
+    :param citations: the scan_citations() of the target, if already known
     :return: lists: direct_citation, indirect_citation, all_citation_name
     '''
+    if citations is None:
+        citations = scan_citations(target)
+    # ordered by pattern, as the citations of the patterns were listed one after another
+    direct_citation = [citation.text for citation in sorted(citations, key=lambda citation: citation.pattern)]
+
+    return direct_citation
 
-    keywords = ["source", "text", "article", "essay", "report", "blog", "post", "book", "chapter", "editorial",
-                "excerpt", "interview", "journal", "lecture", "magazine", "newspaper", "paper", "passage",
-                "quote", "research", "study", "speech", "website"]
+
+def identify_citation_by_pattern(target):
+    '''
+    Reference implementation of identify_citation, with one findall per pattern (used to check and benchmark
+    the scanner)
+    '''
 
     def citation_filter_1(target, expression):
         filtered_list = [s for s in expression.findall(target) if s.split()[1] != "I"]
@@ -84,27 +337,36 @@ def identify_citation(target):
 
     return direct_citation
 
-def build_sent_dict(content):
+def contains_citation(citations, citation_starts, start, end):
+    '''
+    :param citations: the scan_citations() of a text, and citation_starts their start offsets
+    :return: whether the sentence at (start, end) contains a citation (the whole match of the citation is in it)
+    '''
+    i = bisect_left(citation_starts, start)
+    while i < len(citations) and citations[i].start < end:
+        if citations[i].end <= end:
+            return True
+        i += 1
+    return False
+
+
+def build_sent_dict(content, citations=None):
     '''
     This function build dicts for each sentence in an essay, and the dicts contain info of:
     (1) the type of the sentence (citation/non-citation)
     (2) position of the sentence in the paragraph and in the essay
+    :param citations: the scan_citations() of the essay, if already known
     :return: a list of dicts for all sentences in an essay
     '''
+    if citations is None:
+        citations = scan_citations(content)
+    citation_starts = [citation.start for citation in citations]
 
-    def tokenize(content):
-        '''
-        This function tokenize the content of an essay into lists of paragraphs and sentences:
-        [[sentence1, sentence2, sentence...][sentence1, sentence2, ...]]
-        :return: content_list: list of paragraphs and sentences
-        '''
-        content_list = list(filter(bool, content.splitlines()))
-        content_list = [para.strip() for para in content_list]
-        content_list = [split_into_sentences(para) for para in content_list]
-        return content_list
+    # the paragraphs and sentences of the essay, as (start, end) in content:
+    # [[sentence1, sentence2, sentence...][sentence1, sentence2, ...]]
+    content_list = [sentence_spans(content, start, end) for start, end in paragraph_spans(content)]
 
     sent_dict_list = []
-    content_list = tokenize(content)
 
     # a list that directly comprised of sentences in the essay
     all_sent_list = [ sent for para in content_list for sent in para ]
@@ -130,15 +392,15 @@ def build_sent_dict(content):
             raw_location_in_essay = sent_no
             norm_sent_position_in_essay = raw_location_in_essay / how_many_sent_in_essay
             # identify the type of the sentence: contain citations / not contain citations
-            citation_all = identify_citation(content_list[i][j])
+            start, end = content_list[i][j]
 
-            if len(citation_all) != 0:
+            if contains_citation(citations, citation_starts, start, end):
                 sent_type = 'citation'
             else:
                 sent_type = 'non-citation'
 
             # info about the sentence (type and position)
-            sent_dict['sentence']                    = content_list[i][j]
+            sent_dict['sentence']                    = content[start:end]
             sent_dict['sent_type']                   = sent_type
             sent_dict['in_which_para']               = in_which_para
             sent_dict['how_many_para']               = how_many_para_in_essay
@@ -153,12 +415,46 @@ def build_sent_dict(content):
 
     return sent_dict_list
 
-def citation_sent_position(result_dict, input):
+def citation_sent_position(result_dict, input, citations=None):
     '''
     This fuction calculate the position of citation sentences in the paragraph and in the essay
+    :param citations: the scan_citations() of the essay, if already known
     :return: None (the function add in the positional info to the feature dict)
     '''
 
+    sent_dict_list = build_sent_dict(input, citations)
+    # only extract info from the sentences that contain citations
+
+    citation_data_list = []
+    para_position_list = []
+    number_para_list = []
+    for sent_dict in sent_dict_list:
+        if sent_dict['sent_type'] == 'citation':
+            sent_position_list = []
+            para_position_list.append(sent_dict['in_which_para'])
+            number_para_list.append(sent_dict['how_many_para'])
+
+            sent_position_list.append(sent_dict['raw_location_in_essay'])
+            sent_position_list.append(sent_dict['norm_sent_position_in_essay'])
+            sent_position_list.append(sent_dict['raw_location_in_para'])
+            sent_position_list.append(sent_dict['norm_sent_position_in_para'])
+
+            citation_data_list.append(sent_position_list)
+
+    number_para = number_para_list[0] if number_para_list else 0
+    sentence_position_features(result_dict, citation_data_list, para_position_list, number_para)
+
+
+def sentence_position_features(result_dict, citation_data_list, para_position_list, number_para):
+    '''
+    This function adds the sentence position features of the citation sentences to the feature dict
+    (citation_sent_position, and Revision.py for drafts scored paragraph by paragraph)
+    :param citation_data_list: per citation sentence, [raw and norm position in the essay, raw and norm position
+                               in its paragraph]
+    :param para_position_list: per citation sentence, the number of its paragraph
+    :param number_para: the number of paragraphs of the essay
+    '''
+
     def average_sentence_position(citation_data_list, number_unique_para, number_para):
         '''
         Calculate average sentence position of citations in paragraph and in the essay according the df of citations
@@ -187,29 +483,9 @@ def citation_sent_position(result_dict, input):
         # calculate how many percent of paragraphs contain citations
         result_dict['percentage_of_paragraphs_with_citations'] = number_unique_para / number_para
 
-    sent_dict_list = build_sent_dict(input)
-    # only extract info from the sentences that contain citations
-
-    citation_data_list = []
-    para_position_list = []
-    number_para_list = []
-    for sent_dict in sent_dict_list:
-        if sent_dict['sent_type'] == 'citation':
-            sent_position_list = []
-            para_position_list.append(sent_dict['in_which_para'])
-            number_para_list.append(sent_dict['how_many_para'])
-
-            sent_position_list.append(sent_dict['raw_location_in_essay'])
-            sent_position_list.append(sent_dict['norm_sent_position_in_essay'])
-            sent_position_list.append(sent_dict['raw_location_in_para'])
-            sent_position_list.append(sent_dict['norm_sent_position_in_para'])
-
-            citation_data_list.append(sent_position_list)
-
     if len(citation_data_list) != 0:
         # # calculate average citation position in essay based on sentences
         number_unique_para = len(set(para_position_list))
-        number_para = number_para_list[0]
         average_sentence_position(citation_data_list, number_unique_para, number_para)
     else:
         # if there is no citation in an essay at all, fill the positions with "0"
@@ -224,36 +500,81 @@ def citation_sent_position(result_dict, input):
         result_dict['sd_norm_citation_sentence_location_in_para']       = 0
         result_dict['percentage_of_paragraphs_with_citations']          = 0
 
-def citation_word_position(result_dict, content):
+# a word that starts with "***", once the parentheses are removed
+star_word_pattern = re.compile(r'(?<!\S)[()]*\*[()]*\*[()]*\*')
+
+
+def star_word_starts(content):
+    ''':return: a set of the offsets of the words of content that already start with "***" (see citation_word_starts)'''
+    if '*' not in content:
+        return set()
+    return set(match.start() for match in star_word_pattern.finditer(content))
+
+
+def citation_word_starts(content, direct_citation):
+    '''
+    This function finds the words of a text that start with a citation.
+    As in the original implementation, which put "***" before every citation and took the words starting with
+    "***" once the parentheses were removed, a citation also starts a word after stars (e.g. "*Source A"), and the
+    words that already start with "***" are counted as well.
+    :param direct_citation: the distinct citation texts to look for (every occurrence marks a citation)
+    :return: a set of the offsets of those words in content
+    '''
+    # every occurrence of a cited string in the essay marks a citation
+    marks = set()
+    for citation in direct_citation:
+        position = content.find(citation)
+        while position != -1:
+            marks.add(position)
+            position = content.find(citation, position + len(citation))
+    # a mark is at the start of a word if only parentheses (which are not part of the words) and stars precede it
+    # in its token
+    word_starts = star_word_starts(content)
+    for position in marks:
+        word_start = position
+        while word_start > 0 and content[word_start - 1] in '()*':
+            word_start -= 1
+        if word_start == 0 or content[word_start - 1].isspace():
+            word_starts.add(word_start)
+    return word_starts
+
+
+def word_indices(content, word_starts):
+    '''
+    :param word_starts: offsets of words in content (see citation_word_starts)
+    :return: the position index of each of those words (the number of words before it, without parentheses),
+             in text order
+    '''
+    index = []
+    words_before, previous = 0, 0
+    for word_start in sorted(word_starts):
+        words_before += len(content[previous:word_start].replace('(', '').replace(')', '').split())
+        index.append(words_before)
+        previous = word_start
+    return index
+
+
+def citation_word_position(result_dict, content, citations=None):
     '''
     This function calculate word-based position of citations in the essay
+    :param citations: the scan_citations() of the essay, if already known
     :return: None (the function adds in the positional info to the feature dict)
     '''
 
-    def replace_citations(rep, content):
-        # replace the original mark of citations with a new mark that starts with "***"
-        for citation, marked_citation in rep.items():
-            content = content.replace(citation, marked_citation)
-        # print(content)
-        return content
-
     # get the direct and indirect citations in each essay
-    direct_citation = identify_citation(content)
-    direct_citation_set = set(direct_citation)
-    direct_citation = list(direct_citation_set)
-    # dicts that show how the mark of citations should be replaced
-    rep = {citation: "***" + citation for citation in direct_citation}
-    # replace the mark of citations in the essay
-    if len(direct_citation) != 0:
-        text = replace_citations(rep, content)
-    else:
-        text = content
-    # remove parentheses in the essay
-    text = text.replace('(', '').replace(')', '')
-    # print(text)
-    tokens = text.split()
-    # get the position index of words that start with "***", which should be citations
-    index = [i for i in range(len(tokens)) if tokens[i].startswith('***')]
+    if citations is None:
+        citations = scan_citations(content)
+    direct_citation = set(citation.text for citation in citations)
+    # get the position index of the words that start with a citation
+    index = word_indices(content, citation_word_starts(content, direct_citation))
+    word_position_features(result_dict, index)
+
+
+def word_position_features(result_dict, index):
+    '''
+    :param index: the position index of the words that start with a citation
+    :return: None (the function adds in the positional info to the feature dict)
+    '''
     # calculate mean and SD of word-based position of citations in essay
     if len(index) > 0:
         result_dict["average_citation_word_location_in_essay"] = mean(index)
@@ -266,22 +587,36 @@ def citation_word_position(result_dict, content):
         result_dict["sd_citation_word_location_in_essay"]      = 0
 
 
-def citation_char_position(result_dict, content):
+def citation_char_starts(content, direct_citation):
+    '''
+    :param direct_citation: the distinct citation texts (each one searched for as a regular expression, as the
+                            original implementation did)
+    :return: a set of the character positions of their matches in content
+    '''
+    all_char_position = set()
+    for s in direct_citation:
+        all_char_position.update(m.start() for m in re.finditer(s, content))
+    return all_char_position
+
+
+def citation_char_position(result_dict, content, citations=None):
     '''
     This fuction calculate character-based position of citations and add the result to the feature dict
+    :param citations: the scan_citations() of the essay, if already known
     :return: None (the function adds in the positional info to the feature dict)
     '''
 
     # get all character-based position indices of citations in an essay
-    all_citations = identify_citation(content)
-    all_char_position = []
-    for s in set(all_citations):
-        char_position = [m.start() for m in re.finditer(s, content)]
-        for element in char_position:
-            all_char_position.append(element)
+    all_citations = identify_citation(content, citations)
+    all_char_position = list(citation_char_starts(content, set(all_citations)))
+    char_position_features(result_dict, all_char_position)
 
-    all_char_position = list(set(all_char_position))
 
+def char_position_features(result_dict, all_char_position):
+    '''
+    :param all_char_position: the distinct character positions of the citations in the essay
+    :return: None (the function adds in the positional info to the feature dict)
+    '''
     # calculate the mean and SD of the character-based position of citations in the essay
     if len(all_char_position) > 0:
         result_dict["average_citation_character_location_in_essay"] = mean(all_char_position)
@@ -293,20 +628,29 @@ def citation_char_position(result_dict, content):
         result_dict["average_citation_character_location_in_essay"] = 0
         result_dict["sd_citation_character_location_in_essay"]      = 0
 
-def source_citation_coverage(result_dict, content):
+def source_citation_coverage(result_dict, content, citations=None):
     '''
     This function calculates percentages of most cited source, usage of sources, and the frequency of citations
+    :param citations: the scan_citations() of the essay, if already known
     :return: None (the function adds in the frequency info to the feature dict)
     '''
 
     # get all citations in the essay
-    direct_citation = identify_citation(content)
+    direct_citation = identify_citation(content, citations)
+    coverage_features(result_dict, direct_citation, len(content.split()))
+
+
+def coverage_features(result_dict, direct_citation, word_count):
+    '''
+    :param direct_citation: the citations of the essay (see identify_citation)
+    :param word_count: the number of words of the essay
+    :return: None (the function adds in the frequency info to the feature dict)
+    '''
     number_citation = len(direct_citation)
     # number of citations in the essay
     result_dict["count_of_citations"] = number_citation
 
     # calculate the frequency of citations in the essays
-    word_count = len(content.split())
     if word_count != 0:
         frequency_citation = number_citation / word_count
         result_dict["frequency_of_citations"] = frequency_citation
@@ -333,28 +677,20 @@ def source_citation_coverage(result_dict, content):
 
 def citation_features(input):
 
-    global expression_1, expression_2, expression_3, expression_4, expression_5, expression_6
-
-    expression_1 = re.compile(r"([a-zA-Z]+ [A-Z]) ")  # Letters A-Z
-    expression_2 = re.compile(r"\([a-zA-Z]+\s[0-9]+\)", re.IGNORECASE)  # (Letters 0-9)
-    expression_3 = re.compile(r"([a-zA-Z]+\s[0-9] )", re.IGNORECASE)  # Letters 0-9
-    expression_4 = re.compile(r"\([a-zA-Z]+ [A-Z]\)", re.IGNORECASE)  # (Letters A-Z)
-    expression_5 = re.compile(r"\([a-zA-Z]+ et al\., \d{4}\)", re.IGNORECASE)  # (Letters et al., 4-digit number)
-    expression_6 = re.compile(r"\([a-zA-Z]+, \d{4}\)", re.IGNORECASE)  # (Letters, 4-digit number)
-
     result_dict = {}
 
-    citation_sent_position(result_dict, input)
-    citation_word_position(result_dict, input)
-    citation_char_position(result_dict, input)
-    source_citation_coverage(result_dict, input)
+    # find the citations of the essay once, for all features
+    with stage('citation.scan'):
+        citations = scan_citations(input)
+
+    with stage('citation.sentence_position'):
+        citation_sent_position(result_dict, input, citations)
+    with stage('citation.word_position'):
+        citation_word_position(result_dict, input, citations)
+    with stage('citation.char_position'):
+        citation_char_position(result_dict, input, citations)
+    with stage('citation.coverage'):
+        source_citation_coverage(result_dict, input, citations)
     # print("Citation result: ", result_dict)
 
     return result_dict
-
-
-
-
-
-
-
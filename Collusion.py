@@ -0,0 +1,152 @@
+import csv, sys, hashlib
+from collections import namedtuple
+import numpy as np
+from Plagiarism import get_tokens, get_trigrams, Jaccard_similarity_coefficient, SuffixAutomaton
+from Batch import parse_texts
+
+# Essay-vs-essay plagiarism ("collusion") within a cohort: essays are compared with each other through MinHash
+# signatures of their trigram sets (the trigrams of plagiarism algorithm 2), and locality-sensitive hashing (LSH)
+# of the signatures in bands gives the candidate pairs. Only the candidates get the exact Jaccard similarity and
+# longest common sequence, so a cohort of N essays costs O(N) signatures instead of O(N^2) comparisons.
+#
+# Recall and precision are set by the similarity threshold and the number of bands (b) and rows per band (r) of
+# the num_perm = b * r MinHash values: a pair with trigram Jaccard similarity s becomes a candidate with
+# probability 1 - (1 - s^r)^b, an S-curve rising around s = (1/b)^(1/r). More bands (fewer rows) move the curve
+# left: more candidates, fewer missed pairs, more exact checks. lsh_parameters picks b and r for a threshold,
+# weighing missed pairs against extra candidates; more permutations make the curve steeper (and the signatures
+# larger). Pairs below the threshold are dropped after the exact check, so extra candidates only cost time.
+
+# a pair of essays of the cohort, with the MinHash estimate and the exact values of their trigram similarity
+CollusionPair = namedtuple('CollusionPair', ['filename_a', 'filename_b', 'estimated_similarity',
+                                             'jaccard_similarity', 'longest_common_sequence',
+                                             'normed_longest_common_sequence'])
+
+# the hash values of the trigrams are taken modulo this prime, and permuted by (a * x + b) mod prime
+minhash_prime = (1 << 31) - 1
+
+
+def minhash_permutations(num_perm=128, seed=1):
+    '''
+    :return: (a, b): the coefficients of num_perm random hash permutations (a * x + b) mod minhash_prime
+    '''
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, minhash_prime, num_perm).astype(np.uint64)
+    b = generator.randint(0, minhash_prime, num_perm).astype(np.uint64)
+    return a, b
+
+
+def trigram_hash(trigram):
+    '''a hash of a trigram that is the same in every process and run (unlike hash())'''
+    return int.from_bytes(hashlib.blake2b(trigram.encode('utf-8'), digest_size=8).digest(), 'little') % minhash_prime
+
+
+def minhash_signature(trigrams, permutations, hashes=None):
+    '''
+    :param trigrams: the trigram set of an essay (see get_trigrams)
+    :param permutations: the coefficients of minhash_permutations
+    :param hashes: a dict of {trigram: trigram_hash} shared between calls, so repeated trigrams are hashed once
+    :return: the MinHash signature (one minimum hash per permutation), or None for an essay without trigrams
+    '''
+    if not trigrams:
+        return None
+    if hashes is None:
+        hashes = {}
+    values = [hashes[trigram] if trigram in hashes else hashes.setdefault(trigram, trigram_hash(trigram))
+              for trigram in trigrams]
+    a, b = permutations
+    # a * x + b stays below 2^62 for x and a below 2^31, so it does not overflow
+    return ((np.array(values, dtype=np.uint64)[:, None] * a + b) % minhash_prime).min(axis=0)
+
+
+def candidate_probability(similarity, bands, rows):
+    '''the probability that a pair with the given Jaccard similarity becomes an LSH candidate'''
+    return 1 - (1 - similarity ** rows) ** bands
+
+
+def lsh_parameters(threshold, num_perm=128, false_negative_weight=0.95):
+    '''
+    Choose the bands and rows of the LSH for a similarity threshold: the (b, r) with b * r <= num_perm minimizing
+    the weighted area of missed pairs above the threshold and of candidates below it.
+    :param false_negative_weight: the weight of missed pairs (0-1); higher values favour recall over precision.
+                                  The default favours recall, since extra candidates are dropped by the exact check
+                                  (for a threshold of 0.5: 27 bands of 3 rows, finding 97% of the pairs at 0.5)
+    :return: (bands, rows)
+    '''
+    below = np.linspace(0, threshold, 200)
+    above = np.linspace(threshold, 1, 200)
+    best, best_error = None, None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            # the areas under the curve below the threshold and above it under 1 - the curve
+            false_positive = candidate_probability(below, bands, rows).mean() * threshold
+            false_negative = (1 - candidate_probability(above, bands, rows)).mean() * (1 - threshold)
+            error = (1 - false_negative_weight) * false_positive + false_negative_weight * false_negative
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+def lsh_candidate_pairs(signatures, bands, rows):
+    '''
+    Hash the signatures band by band; essays sharing the hash of any band are candidates
+    :param signatures: a list of MinHash signatures (None for essays without trigrams, which are skipped)
+    :return: a set of (i, j) index pairs with i < j
+    '''
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        for number, signature in enumerate(signatures):
+            if signature is not None:
+                buckets.setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(number)
+        for numbers in buckets.values():
+            for i, first in enumerate(numbers):
+                for second in numbers[i + 1:]:
+                    candidates.add((first, second))
+    return candidates
+
+
+def find_collusion(records, nlp, threshold=0.5, num_perm=128, bands=None, rows=None, false_negative_weight=0.95,
+                   seed=1, batch_size=64):
+    '''
+    Find the pairs of essays of a cohort with a trigram Jaccard similarity of at least threshold
+    :param records: an iterable of (filename, text)
+    :param nlp: the spaCy pipeline to tokenize the essays with (as for plagiarism_features)
+    :param threshold: the trigram Jaccard similarity from which a pair is reported
+    :param num_perm: the number of MinHash permutations
+    :param bands, rows: the LSH bands and rows per band (b * r <= num_perm); chosen by lsh_parameters if None
+    :param false_negative_weight: see lsh_parameters
+    :return: a list of CollusionPair, most similar first
+    '''
+    if bands is None or rows is None:
+        bands, rows = lsh_parameters(threshold, num_perm, false_negative_weight)
+    permutations = minhash_permutations(num_perm, seed)
+    hashes = {}
+    filenames, essay_tokens, signatures = [], [], []
+    filename_texts = ((text, filename) for filename, text in records)
+    for parsed, filename in parse_texts(nlp, filename_texts, batch_size):
+        # interned, the token strings repeated across the cohort are kept once
+        tokens = [sys.intern(token) for token in get_tokens(parsed)]
+        filenames.append(filename)
+        essay_tokens.append(tokens)
+        signatures.append(minhash_signature(get_trigrams(tokens), permutations, hashes))
+
+    pairs = []
+    for first, second in lsh_candidate_pairs(signatures, bands, rows):
+        estimated = float(np.mean(signatures[first] == signatures[second]))
+        jaccard = Jaccard_similarity_coefficient(get_trigrams(essay_tokens[first]),
+                                                 get_trigrams(essay_tokens[second]))
+        if jaccard < threshold:
+            continue
+        longest = SuffixAutomaton(essay_tokens[first]).longest_common_run(essay_tokens[second])
+        pairs.append(CollusionPair(filenames[first], filenames[second], estimated, jaccard, longest,
+                                   longest / min(len(essay_tokens[first]), len(essay_tokens[second]))))
+    pairs.sort(key=lambda pair: (-pair.jaccard_similarity, pair.filename_a, pair.filename_b))
+    return pairs
+
+
+def write_collusion_pairs(pairs, path):
+    '''write the pairs of find_collusion to a CSV file'''
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(CollusionPair._fields)
+        writer.writerows(pairs)
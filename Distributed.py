@@ -0,0 +1,388 @@
+import os, sys, time, uuid, pickle, shutil, threading, traceback
+from collections import deque
+from itertools import islice
+from Batch import score_texts, feature_pipeline
+
+# Distributed scoring: a coordinator (main.py) splits the essays into tasks and puts them on a queue shared with
+# worker processes, which may run on other machines; the source index is stored once next to the queue and loaded
+# by every worker. Workers score the tasks with Batch.score_texts and put the feature dicts on the result queue of
+# the coordinator.
+# Delivery is at least once: a worker acknowledges a task only after its results are on the result queue, and a
+# task that is not acknowledged within lease_seconds (e.g. its worker died) is delivered again. The results of a
+# task scored twice are dropped by the coordinator, which keeps the first.
+#
+# Queue backends (see open_backend): in memory (worker threads in one process, for tests), a folder on a local
+# or shared filesystem, or Redis. A backend has put, get and ack for messages (any picklable object) and
+# put_blob / get_blob for the shared payloads, and delete_queue for the result queue of a finished job.
+
+# the queue of the tasks, shared by all coordinators and workers
+TASK_QUEUE = 'tasks'
+
+
+class MemoryQueue:
+    '''
+    Queues in the memory of one process, for worker threads (run_worker) and tests of the distributed flow.
+    Messages are pickled, as by the other backends.
+    '''
+
+    def __init__(self, lease_seconds=600):
+        self.lease_seconds = lease_seconds
+        self._condition = threading.Condition()
+        self._ready   = {}
+        self._claimed = {}
+        self._blobs   = {}
+
+    def put(self, queue, message):
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._condition:
+            self._ready.setdefault(queue, deque()).append(data)
+            self._condition.notify_all()
+
+    def get(self, queue, timeout=1.0):
+        '''
+        Claim the next message of a queue, waiting up to timeout seconds
+        :return: (receipt, message), or None if the queue stayed empty
+        '''
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                claimed = self._claimed.setdefault(queue, {})
+                ready   = self._ready.setdefault(queue, deque())
+                for receipt, (lease_end, data) in list(claimed.items()):
+                    if lease_end < now:
+                        del claimed[receipt]
+                        ready.append(data)
+                if ready:
+                    data = ready.popleft()
+                    receipt = uuid.uuid4().hex
+                    claimed[receipt] = (now + self.lease_seconds, data)
+                    return receipt, pickle.loads(data)
+                if now >= deadline:
+                    return None
+                self._condition.wait(min(deadline - now, 0.1))
+
+    def ack(self, queue, receipt):
+        '''remove a claimed message from its queue (a message whose lease ran out may be delivered again)'''
+        with self._condition:
+            self._claimed.get(queue, {}).pop(receipt, None)
+
+    def delete_queue(self, queue):
+        with self._condition:
+            self._ready.pop(queue, None)
+            self._claimed.pop(queue, None)
+
+    def put_blob(self, key, data):
+        self._blobs[key] = data
+
+    def get_blob(self, key):
+        return self._blobs[key]
+
+
+class FileQueue:
+    '''
+    Queues in a folder, for workers in other processes of the machine, or on other machines mounting the folder.
+    A message is a file in <folder>/<queue>/ready; a worker claims it by renaming it into <folder>/<queue>/claimed
+    (an atomic step, so only one worker gets it) under a name holding the end of its lease.
+    '''
+
+    def __init__(self, path, lease_seconds=600, poll_interval=0.1):
+        self.path          = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        os.makedirs(os.path.join(path, 'blobs'), exist_ok=True)
+
+    def _folders(self, queue):
+        ready, claimed = os.path.join(self.path, queue, 'ready'), os.path.join(self.path, queue, 'claimed')
+        os.makedirs(ready, exist_ok=True)
+        os.makedirs(claimed, exist_ok=True)
+        return ready, claimed
+
+    def put(self, queue, message):
+        ready, _ = self._folders(queue)
+        # named by time, so messages are claimed in about the order they were put
+        name = f'{time.time_ns():020d}-{uuid.uuid4().hex}'
+        _write_file(os.path.join(ready, name), pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def get(self, queue, timeout=1.0):
+        '''
+        Claim the next message of a queue, waiting up to timeout seconds
+        :return: (receipt, message), or None if the queue stayed empty
+        '''
+        ready, claimed = self._folders(queue)
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time_ns()
+            # messages whose lease ran out go back to the queue
+            for receipt in os.listdir(claimed):
+                lease_end, _, name = receipt.partition('.')
+                if int(lease_end) < now:
+                    try:
+                        os.rename(os.path.join(claimed, receipt), os.path.join(ready, name))
+                    except FileNotFoundError:
+                        pass
+            for name in sorted(os.listdir(ready)):
+                if name.startswith('.'):
+                    continue
+                receipt = f'{now + int(self.lease_seconds * 1e9):020d}.{name}'
+                try:
+                    os.rename(os.path.join(ready, name), os.path.join(claimed, receipt))
+                except FileNotFoundError:
+                    # claimed by another worker
+                    continue
+                with open(os.path.join(claimed, receipt), 'rb') as file:
+                    return receipt, pickle.loads(file.read())
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def ack(self, queue, receipt):
+        '''remove a claimed message from its queue (a message whose lease ran out may be delivered again)'''
+        _, claimed = self._folders(queue)
+        try:
+            os.remove(os.path.join(claimed, receipt))
+        except FileNotFoundError:
+            pass
+
+    def delete_queue(self, queue):
+        shutil.rmtree(os.path.join(self.path, queue), ignore_errors=True)
+
+    def put_blob(self, key, data):
+        _write_file(os.path.join(self.path, 'blobs', key), data)
+
+    def get_blob(self, key):
+        with open(os.path.join(self.path, 'blobs', key), 'rb') as file:
+            return file.read()
+
+
+def _write_file(path, data):
+    # write to a hidden file first, so a reader never sees a partly written file
+    folder, name = os.path.split(path)
+    temp_path = os.path.join(folder, '.' + name + '.tmp')
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+class RedisQueue:
+    '''
+    Queues in a Redis server (needs the redis package), for workers on any machine that reaches it.
+    A queue is a list of message ids, with the messages in a hash and the claimed ids in a sorted set by the end
+    of their lease; claiming and returning expired messages are Lua scripts, so each step is atomic.
+    '''
+
+    _claim_script = '''
+        local id = redis.call('RPOP', KEYS[1])
+        if id then redis.call('ZADD', KEYS[2], ARGV[1], id) end
+        return id'''
+    _expire_script = '''
+        local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+        for _, id in ipairs(ids) do
+            redis.call('ZREM', KEYS[2], id)
+            redis.call('LPUSH', KEYS[1], id)
+        end
+        return #ids'''
+
+    def __init__(self, url, lease_seconds=600, poll_interval=0.1):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError('the Redis queue needs the redis package (pip install redis)')
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._redis  = redis.Redis.from_url(url)
+        self._claim  = self._redis.register_script(self._claim_script)
+        self._expire = self._redis.register_script(self._expire_script)
+
+    @staticmethod
+    def _keys(queue):
+        return f'{queue}:ready', f'{queue}:claimed', f'{queue}:messages'
+
+    def put(self, queue, message):
+        ready, _, messages = self._keys(queue)
+        message_id = uuid.uuid4().hex
+        self._redis.hset(messages, message_id, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+        self._redis.lpush(ready, message_id)
+
+    def get(self, queue, timeout=1.0):
+        '''
+        Claim the next message of a queue, waiting up to timeout seconds
+        :return: (receipt, message), or None if the queue stayed empty
+        '''
+        ready, claimed, messages = self._keys(queue)
+        deadline = time.monotonic() + timeout
+        while True:
+            self._expire(keys=[ready, claimed], args=[time.time()])
+            message_id = self._claim(keys=[ready, claimed], args=[time.time() + self.lease_seconds])
+            if message_id is not None:
+                data = self._redis.hget(messages, message_id)
+                if data is not None:
+                    return message_id, pickle.loads(data)
+                # acknowledged meanwhile by the worker whose lease ran out
+                self._redis.zrem(claimed, message_id)
+                continue
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def ack(self, queue, receipt):
+        '''remove a claimed message from its queue (a message whose lease ran out may be delivered again)'''
+        _, claimed, messages = self._keys(queue)
+        self._redis.zrem(claimed, receipt)
+        self._redis.hdel(messages, receipt)
+
+    def delete_queue(self, queue):
+        self._redis.delete(*self._keys(queue))
+
+    def put_blob(self, key, data):
+        self._redis.set(f'blob:{key}', data)
+
+    def get_blob(self, key):
+        data = self._redis.get(f'blob:{key}')
+        if data is None:
+            raise KeyError(key)
+        return data
+
+
+def open_backend(url, lease_seconds=600):
+    '''
+    :param url: 'file:///path/to/folder' for a FileQueue, 'redis://host:port/db' for a RedisQueue, or 'memory://'
+                for a MemoryQueue (only shared by the threads of this process)
+    :param lease_seconds: how long a worker may take to score a task before it is delivered again
+    '''
+    if url.startswith('file://'):
+        return FileQueue(url[len('file://'):], lease_seconds)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisQueue(url, lease_seconds)
+    if url == 'memory://':
+        return MemoryQueue(lease_seconds)
+    raise ValueError(f'unknown queue {url!r} (expected file://, redis:// or memory://)')
+
+
+class Coordinator:
+    '''
+    Scores essays on the workers of a queue: the essays are put on the task queue in tasks of chunk_size essays,
+    with at most max_pending tasks waiting at a time (so a corpus of any size is read as it is scored), and the
+    feature dicts are returned as the tasks are finished, each task once.
+    '''
+
+    def __init__(self, backend, source, features=None, spacy_model=None, chunk_size=64, max_pending=256,
+                 batch_size=64, screening=None):
+        '''
+        :param backend: a queue backend (see open_backend)
+        :param source: a SourceIndex or SourceLibrary (None if the selected features do not use the source),
+                       stored once for all workers
+        :param features, spacy_model, screening: the features to compute, the spaCy model and the screening
+                                                 thresholds (as in main.py)
+        '''
+        self.backend     = backend
+        self.features    = features
+        self.spacy_model = spacy_model
+        self.screening   = screening
+        self.chunk_size  = chunk_size
+        self.max_pending = max_pending
+        self.batch_size  = batch_size
+        self.job         = uuid.uuid4().hex
+        self.reply_to    = 'results-' + self.job
+        self.tasks       = 0
+        self.duplicates  = 0
+        self.source_key  = None
+        if source is not None:
+            self.source_key = 'source-' + source.fingerprint
+            backend.put_blob(self.source_key, pickle.dumps(source, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def score(self, records):
+        '''
+        :param records: an iterable of (filename, text)
+        :return: a generator of feature dicts (as Batch.score_texts), in the order the tasks are finished
+        '''
+        records = iter(records)
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.max_pending:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    exhausted = True
+                    break
+                task_id = f'{self.job}-{self.tasks}'
+                self.tasks += 1
+                self.backend.put(TASK_QUEUE, {'task': task_id, 'reply_to': self.reply_to, 'records': chunk,
+                                              'source': self.source_key, 'features': self.features,
+                                              'spacy_model': self.spacy_model, 'batch_size': self.batch_size,
+                                              'screening': self.screening})
+                pending.add(task_id)
+            if exhausted and not pending:
+                self.backend.delete_queue(self.reply_to)
+                return
+            claimed = self.backend.get(self.reply_to)
+            if claimed is None:
+                continue
+            receipt, result = claimed
+            if result['task'] in pending:
+                if result.get('error') is not None:
+                    raise RuntimeError(f"a worker could not score task {result['task']}:\n{result['error']}")
+                pending.discard(result['task'])
+                yield from result['rows']
+            else:
+                # a task delivered twice: its first results are already returned
+                self.duplicates += 1
+            self.backend.ack(self.reply_to, receipt)
+
+
+def run_worker(backend, idle_timeout=None, stop=None):
+    '''
+    Score the tasks of the queue until stop (a threading.Event) is set, or no task came for idle_timeout seconds
+    :param backend: a queue backend (see open_backend)
+    :return: the number of tasks scored
+    '''
+    pipelines, sources = {}, {}
+    scored = 0
+    idle_since = time.monotonic()
+    while stop is None or not stop.is_set():
+        claimed = backend.get(TASK_QUEUE)
+        if claimed is None:
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                break
+            continue
+        receipt, task = claimed
+        result = {'task': task['task']}
+        try:
+            features = tuple(task['features']) if isinstance(task['features'], list) else task['features']
+            if (features, task['spacy_model']) not in pipelines:
+                pipelines[features, task['spacy_model']] = feature_pipeline(task['features'], task['spacy_model'])
+            if task['source'] is not None and task['source'] not in sources:
+                sources[task['source']] = pickle.loads(backend.get_blob(task['source']))
+            result['rows'] = list(score_texts(pipelines[features, task['spacy_model']], task['records'],
+                                              sources.get(task['source']), batch_size=task['batch_size'],
+                                              workers=1, features=task['features'],
+                                              screening=task.get('screening')))
+        except Exception:
+            result['error'] = traceback.format_exc()
+        backend.put(task['reply_to'], result)
+        backend.ack(TASK_QUEUE, receipt)
+        scored += 1
+        idle_since = time.monotonic()
+    return scored
+
+
+def _worker_process(url, lease_seconds):
+    run_worker(open_backend(url, lease_seconds))
+
+
+if __name__ == '__main__':
+    # Usage: python Distributed.py worker <queue URL> [number of processes]
+    # (start it on every machine; main.py is the coordinator when its distributed_queue is set to the same URL)
+    if len(sys.argv) < 3 or sys.argv[1] != 'worker':
+        sys.exit('Usage: python Distributed.py worker <queue URL> [number of processes]')
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    if processes == 1:
+        _worker_process(sys.argv[2], 600)
+    else:
+        import multiprocessing
+        workers = [multiprocessing.Process(target=_worker_process, args=(sys.argv[2], 600))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,204 @@
+import os, csv, json, hashlib
+from Plagiarism import SourceLibrary
+
+
+def content_hash(text):
+    '''a hash of a text, used to recognize essays (and sources) that did not change since they were scored'''
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResultWriter:
+    '''
+    Writes the feature dicts to the output CSV file as soon as each essay is scored, and keeps a manifest
+    (a JSON-lines file next to the output) of the scored essays, keyed by filename and content hash.
+    When a run is interrupted, or essays are added or changed, the next run only scores the essays that are
+    not in the manifest with the same content; rows of changed essays are replaced in the output.
+    A manifest written with another fingerprint (e.g. for other source texts) starts the output over.
+
+    Usage:
+        with ResultWriter(output_csv_path, fingerprint=content_hash(source_text)) as writer:
+            for result_dict in score_texts(nlp, writer.pending(records), source):
+                writer.write(result_dict)
+    '''
+
+    def __init__(self, output_csv_path, manifest_path=None, fingerprint=''):
+        '''
+        :param output_csv_path: path of the output CSV file
+        :param manifest_path: path of the manifest (default: the output path + ".manifest.jsonl")
+        :param fingerprint: a string identifying everything besides the essay the results depend on
+        '''
+        self.output_csv_path = output_csv_path
+        self.manifest_path   = manifest_path or output_csv_path + '.manifest.jsonl'
+        self.fingerprint     = fingerprint
+        # filename -> content hash of the scored essays, and of the essays being scored; the filenames of the
+        # records of this run
+        self.scored   = {}
+        self._pending = {}
+        self._seen    = set()
+        self._rescored = False
+        self.headers  = None
+        self.written  = 0
+        self.skipped  = 0
+
+        self._dirty = self._load()
+        if not self.scored:
+            # start over: the output has no usable rows
+            with open(self.manifest_path, 'w', encoding='utf-8') as file:
+                file.write(json.dumps({'fingerprint': fingerprint}) + '\n')
+            open(self.output_csv_path, 'w').close()
+            self.headers = None
+            self._dirty = False
+        self._manifest = open(self.manifest_path, 'a', encoding='utf-8')
+        self._csvfile  = open(self.output_csv_path, 'a', newline='', encoding='utf-8')
+        self._writer   = csv.DictWriter(self._csvfile, fieldnames=self.headers) if self.headers else None
+
+    def _load(self):
+        '''
+        load the manifest and check the output rows against it
+        :return: whether the output needs to be rewritten (it has rows missing from the manifest or duplicates)
+        '''
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.output_csv_path)):
+            return False
+        with open(self.manifest_path, 'r', encoding='utf-8') as file:
+            lines = [line for line in file if line.endswith('\n')]
+        if not lines or json.loads(lines[0]).get('fingerprint') != self.fingerprint:
+            return False
+        for line in lines[1:]:
+            entry = json.loads(line)
+            self.scored[entry['Filename']] = entry['hash']
+
+        # drop a row cut off by a crash, then check the rows against the manifest
+        with open(self.output_csv_path, 'rb+') as file:
+            data = file.read()
+            if data and not data.endswith(b'\n'):
+                file.truncate(data.rfind(b'\n') + 1)
+        with open(self.output_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            self.headers = reader.fieldnames
+            filenames = [row['Filename'] for row in reader]
+        if self.headers is None:
+            self.scored = {}
+            return False
+        # essays in the manifest without a row in the output are scored again
+        rows = set(filenames)
+        self.scored = {filename: text_hash for filename, text_hash in self.scored.items() if filename in rows}
+        return len(filenames) != len(rows) or rows != set(self.scored)
+
+    def pending(self, records):
+        '''
+        :param records: an iterable of (filename, text), with unique filenames (the rows and the manifest are
+                        keyed by filename)
+        :return: a generator of the records that still need to be scored
+        '''
+        for filename, text in records:
+            if filename in self._seen:
+                raise ValueError(f'more than one text has the id {filename!r}; give every text a unique id')
+            self._seen.add(filename)
+            text_hash = content_hash(text)
+            if self.scored.get(filename) == text_hash:
+                self.skipped += 1
+                continue
+            if filename in self.scored:
+                self._rescored = True
+            self._pending[filename] = text_hash
+            yield filename, text
+
+    def write(self, result_dict):
+        '''write the feature dict of an essay (from a record passed through pending()) to the output'''
+        if self._writer is None:
+            self.headers = list(result_dict.keys())
+            self._writer = csv.DictWriter(self._csvfile, fieldnames=self.headers)
+            self._writer.writeheader()
+        elif result_dict.keys() != set(self.headers):
+            raise ValueError(f'the columns of {result_dict["Filename"]} do not match the columns of '
+                             f'{self.output_csv_path}; remove it and its manifest to start over')
+        self._writer.writerow(result_dict)
+        self._csvfile.flush()
+
+        filename = result_dict['Filename']
+        text_hash = self._pending.pop(filename)
+        self._manifest.write(json.dumps({'Filename': filename, 'hash': text_hash}) + '\n')
+        self._manifest.flush()
+        self.scored[filename] = text_hash
+        self.written += 1
+
+    def close(self):
+        '''close the files, and rewrite them without replaced rows if any essay was scored again'''
+        self._csvfile.close()
+        self._manifest.close()
+        if self._dirty or self._rescored:
+            self._compact()
+
+    def _compact(self):
+        # keep the last row of every essay in the manifest
+        temp_path = self.output_csv_path + '.tmp'
+        with open(self.output_csv_path, 'r', newline='', encoding='utf-8') as csvfile:
+            last_row = {}
+            for number, row in enumerate(csv.DictReader(csvfile)):
+                if row['Filename'] in self.scored:
+                    last_row[row['Filename']] = number
+        keep = set(last_row.values())
+        with open(self.output_csv_path, 'r', newline='', encoding='utf-8') as csvfile, \
+                open(temp_path, 'w', newline='', encoding='utf-8') as tempfile:
+            reader = csv.DictReader(csvfile)
+            writer = csv.DictWriter(tempfile, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            for number, row in enumerate(reader):
+                if number in keep:
+                    writer.writerow(row)
+        os.replace(temp_path, self.output_csv_path)
+
+        scored = {filename: self.scored[filename] for filename in last_row}
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'fingerprint': self.fingerprint}) + '\n')
+            for filename, text_hash in scored.items():
+                file.write(json.dumps({'Filename': filename, 'hash': text_hash}) + '\n')
+        os.replace(temp_path, self.manifest_path)
+        self.scored = scored
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# the columns of write_copied_spans
+COPIED_SPAN_COLUMNS = ['Filename', 'Source', 'Essay_start', 'Essay_end', 'Source_start', 'Source_end', 'Words',
+                       'Copied_token_ratio', 'Source_coverage', 'Passage']
+
+
+def copied_span_report(records, source):
+    '''
+    The copied spans of a stream of essays, for reviewers to find the copied passages: one row per span, with
+    its character offsets in the essay and in the source, its number of words, the share of the essay words
+    copied from the source and of the source words copied, and the passage
+    :param records: an iterable of (filename, text)
+    :param source: a SourceIndex, or a SourceLibrary (the "Source" column names the source of each span)
+    :return: a generator of rows, lists in the order of COPIED_SPAN_COLUMNS
+    '''
+    for filename, text in records:
+        if isinstance(source, SourceLibrary):
+            alignments = [(source.names[number], alignment) for number, alignment in source.copied_spans(text).items()]
+        else:
+            alignments = [('', source.spans.align(text))]
+        for name, alignment in alignments:
+            for span in alignment.spans:
+                yield [filename, name, span.essay_start, span.essay_end, span.source_start, span.source_end,
+                       span.words, alignment.copied_ratio, alignment.source_coverage,
+                       text[span.essay_start:span.essay_end]]
+
+
+def write_copied_spans(rows, path):
+    '''
+    write the rows of copied_span_report to a CSV file
+    :return: the number of rows
+    '''
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(COPIED_SPAN_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
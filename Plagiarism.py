@@ -1,8 +1,26 @@
-import re, string
-import spacy
-from spacy.util import filter_spans
+import re, string, pickle, hashlib
+from array import array
+from collections import Counter, namedtuple
+from itertools import repeat
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer
+from Profiling import stage
+
+# Version of the features of this module; increase it when a change alters their values (invalidates cached results)
+FEATURE_VERSION = 2
+# Version of the data of SourceIndex and SourceLibrary; increase it when it changes (saved indexes are rebuilt)
+INDEX_VERSION = 5
+# The columns of plagiarism_features (with the default ngram range; a SourceLibrary adds "Best_source" and the
+# per-source columns "<column>_<source name>", and screening adds the SCREENING_COLUMNS)
+SCREENING_COLUMNS = ['Screening_tier', 'Screening_ngram_overlap']
+FEATURE_COLUMNS = ['Containment_' + str(n) + '_score' for n in range(1, 7)] + \
+                  ['Jaccard_similarity_score', 'Containment_measure_score', 'Longest_common_sequence',
+                   'Normed_longest_common_sequence', 'Copied_span_count', 'Copied_token_ratio', 'Best_source'] + \
+                  SCREENING_COLUMNS
+# The dtypes of the columns in a typed result table (see Results.ResultTable): the "Int32" columns can be missing
+# (in the screening tier), and "N/A" is a missing value (NaN in the float columns)
+FEATURE_DTYPES = dict.fromkeys(FEATURE_COLUMNS, 'float64')
+FEATURE_DTYPES.update({'Longest_common_sequence': 'Int32', 'Copied_span_count': 'Int32',
+                       'Best_source': 'category', 'Screening_tier': 'category'})
 
 # Note: Parts of this algorithm are adapted or implemented from the following two plagiarism detection projects:
 # URL: https://github.com/AashitaK/Plagiarism-Detection/blob/master/notebook.ipynb
@@ -22,12 +40,123 @@ def string_preprocessing(text_data):
 
 def calculate_ngrams(n, e_text, s_text):
     # for plagiarism algorithm 1
+    # (imported here: scikit-learn takes seconds to import, and only this reference implementation uses it)
+    from sklearn.feature_extraction.text import CountVectorizer
     counts = CountVectorizer(analyzer='word', ngram_range=(n, n))
     ngram_array = counts.fit_transform([e_text, s_text]).toarray()
     # print("ngram array: ", ngram_array)
     return ngram_array
 
 
+# CountVectorizer's default tokenization (lowercase, then token_pattern r"(?u)\b\w\w+\b")
+ngram_token_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+
+def ngram_tokens(text):
+    # for plagiarism algorithm 1
+    '''tokenize a (preprocessed) text into the words calculate_ngrams builds its ngrams from'''
+    return ngram_token_pattern.findall(text.lower())
+
+
+# a character that cannot be part of a word of ngram_tokens
+ngram_separator_pattern = re.compile(r"(?u)\W")
+
+
+def ngram_token_ids(text, vocabulary, slice_length=1 << 16):
+    # for plagiarism algorithm 1
+    '''
+    the ids of the ngram_tokens of a preprocessed text in a vocabulary (0 for the words not in it).
+    The text is read in slices ending at a non-word character, so the word strings of only one slice are kept
+    at a time, and is not lower-cased again (string_preprocessing already did, and lower-casing twice changes
+    nothing).
+    :return: an array('I') of the ids
+    '''
+    ids = array('I')
+    start = 0
+    while start < len(text):
+        separator = ngram_separator_pattern.search(text, min(start + slice_length, len(text)))
+        end = separator.start() if separator is not None else len(text)
+        ids.extend(map(vocabulary.get, ngram_token_pattern.findall(text, start, end), repeat(0)))
+        start = end + 1
+    return ids
+
+
+def rolling_ngram_keys(token_ids, base, max_n):
+    '''
+    Roll the keys of all ngrams up to size max_n in one pass over the token ids.
+    The key of an ngram is its ids read as a number in the given base (key = key * base + id), so
+    keys are exact (no collisions) and every ngram is derived from the one before it.
+    An id of 0 marks a token that cannot be part of a matching ngram and stops the roll.
+    :return: a generator of (n, key) pairs
+    '''
+    length = len(token_ids)
+    for i in range(length):
+        key = 0
+        for j in range(i, min(i + max_n, length)):
+            token_id = token_ids[j]
+            if token_id == 0:
+                break
+            key = key * base + token_id
+            yield j - i + 1, key
+
+
+def source_ngram_numbers(word_ids, source, max_n):
+    # for plagiarism algorithm 1
+    '''
+    Look up the ngrams of a sequence of word ids in the numbered ngrams of a source (see SourceIndex.ngram_tables),
+    one size at a time: an ngram of size n is found from the number of its first n - 1 words and its last word id
+    :param word_ids: a numpy int64 array of ids of source.vocabulary (0 for other words)
+    :return: a generator of (n, numbers): the source ngram number of the ngram of size n starting at each position
+             (-1 where it is not a source ngram)
+    '''
+    numbers = np.where(word_ids > 0, word_ids, -1)
+    yield 1, numbers
+    for n in range(2, max_n + 1):
+        keys = source.ngram_tables[n][0]
+        ngram_keys = numbers[:-1] * source.ngram_base + word_ids[n - 1:]
+        if len(keys) == 0:
+            numbers = np.full(len(ngram_keys), -1)
+        else:
+            found = np.searchsorted(keys, ngram_keys)
+            found[found == len(keys)] = 0
+            numbers = np.where((numbers[:-1] >= 0) & (word_ids[n - 1:] > 0) & (keys[found] == ngram_keys), found, -1)
+        yield n, numbers
+
+
+def containment_scores(essay_text, source, ngram_range=None):
+    '''Calculates the containment between an essay text and a source for every ngram size at once.
+       The essay is tokenized once into ids of the source vocabulary, and its ngrams of each size are looked up
+       in the numbered source ngrams and counted with NumPy, so this replaces one calculate_containment() call
+       per n, with the same values.
+       :param essay_text: the preprocessed essay text
+       :param source: a SourceIndex
+       :param ngram_range: the ngram sizes to score, a subset of source.ngram_range (default: all of them)
+       :return: a dict of {n: containment value}; nan if the essay has no ngram of size n, as with containment()
+    '''
+    # for plagiarism algorithm 1
+    return id_containment_scores(ngram_token_ids(essay_text, source.vocabulary), source, ngram_range)
+
+
+def id_containment_scores(token_ids, source, ngram_range=None):
+    '''the containment_scores() of an essay from its ngram_token_ids()'''
+    # for plagiarism algorithm 1
+    ngram_range = source.ngram_range if ngram_range is None else list(ngram_range)
+
+    intersection = {}
+    for n, numbers in source_ngram_numbers(np.array(token_ids, dtype=np.int64), source, max(ngram_range)):
+        if n in ngram_range:
+            # count each essay ngram at most as often as it occurs in the source: sum of min(count_a, count_b)
+            source_counts = source.ngram_tables[n][1]
+            counts = np.bincount(numbers[numbers >= 0], minlength=len(source_counts))
+            intersection[n] = int(np.minimum(counts, source_counts).sum())
+
+    scores = {}
+    for n in ngram_range:
+        total_ngram_a = len(token_ids) - n + 1
+        scores[n] = intersection[n] / total_ngram_a if total_ngram_a > 0 else float('nan')
+    return scores
+
+
 def containment(ngram_array):
     ''' Containment is a measure of text similarity. It is the normalized, intersection of ngram word counts in two texts.
        :param ngram_array: an array of ngram counts for an answer and source text.
@@ -72,6 +201,51 @@ def get_trigrams(tokens):
     trigrams = set(trigrams)
     return trigrams
 
+# trigram keys pack the ids of the three tokens of a trigram into 64 bits, 21 bits each
+trigram_id_bits = 21
+
+
+def essay_token_ids(tokens, vocabulary):
+    '''
+    Map a token list to the ids of a vocabulary (a dict of {token: id}, ids from 1). Tokens not in it get the
+    next ids (the same id for the same token), so they match nothing in the vocabulary's text but keep their
+    trigrams distinct.
+    :return: an array('I') of the ids
+    '''
+    unknown = {}
+    size = len(vocabulary)
+    ids = array('I', [vocabulary.get(token) or unknown.setdefault(token, size + len(unknown) + 1)
+                      for token in tokens])
+    if size + len(unknown) >= 1 << trigram_id_bits:
+        raise ValueError(f'more than {(1 << trigram_id_bits) - 1} distinct tokens do not fit in the trigram keys')
+    return ids
+
+
+def trigram_keys(ids):
+    # for plagiarism algorithm 2
+    '''
+    Pack the trigrams of a sequence of token ids into 64-bit keys (the first id in the high bits)
+    :param ids: an array('I') of token ids (see essay_token_ids)
+    :return: a sorted numpy array of the distinct keys: one per trigram of get_trigrams() on the tokens
+    '''
+    if len(ids) < 3:
+        return np.empty(0, dtype=np.uint64)
+    ids  = np.frombuffer(ids, dtype=np.uint32).astype(np.uint64)
+    bits = np.uint64(trigram_id_bits)
+    return np.unique((ids[:-2] << (bits + bits)) | (ids[1:-1] << bits) | ids[2:])
+
+
+def bigram_keys(ids):
+    '''the keys of the token id bigrams of a sequence of token ids, as Python ints'''
+    return [(first << trigram_id_bits) | second for first, second in zip(ids, ids[1:])]
+
+
+def shared_trigrams(A, B):
+    # for plagiarism algorithm 2
+    '''the number of trigrams in two sorted arrays of trigram keys (len(A.intersection(B)) of the trigram sets)'''
+    return int(np.intersect1d(A, B, assume_unique=True).size)
+
+
 def Jaccard_similarity_coefficient(A, B):
     # for plagiarism algorithm 2
     J = len(A.intersection(B))/len(A.union(B))
@@ -109,43 +283,833 @@ def LCS(A, B):
     # print("longest", longest)
     return longest
 
-def plagiarism_features(input, input_doc, source, source_doc):
+class SourceIndex:
+    '''
+    Source-side data of the plagiarism algorithms, computed once per source text instead of once per essay:
+    the preprocessed string, the ngram counts for the containment scores, the tokens as ids of a token vocabulary,
+    their trigram keys and screening ngram keys, the suffix automaton over the ids for the longest common sequence,
+    the SpanIndex for the copied spans, and the QuotationIndex for the quotation features.
+    An index can be saved to disk and loaded again, and is accepted by plagiarism_features and
+    quotation_features wherever the raw source text is.
+    '''
 
-    input_text = string_preprocessing(input)
-    source_text = string_preprocessing(source)
+    def __init__(self, source, source_doc, ngram_range=range(1, 7)):
+        '''
+        :param source: the raw source text
+        :param source_doc: the spaCy Doc of the source text
+        :param ngram_range: the ngram sizes of the containment scores
+        '''
+        self.source_text  = source
+        self.preprocessed = string_preprocessing(source)
 
-    result_dict = {}
+        # The ngrams of the containment scores, numbered over ids of the source vocabulary (ids start at 1).
+        # The ngrams of size n are numbered 0, 1, ... and each is identified by the number of its first n - 1 words
+        # and the id of its last word, as the key prefix * ngram_base + word id (single words are numbered by
+        # their vocabulary id); every prefix of a source ngram is a source ngram, so this numbers all of them.
+        # ngram_tables is a dict of {n: (keys, counts)}: the sorted keys of the ngrams of size n (None for n = 1)
+        # and the source count of each ngram number.
+        ngram_words     = ngram_tokens(self.preprocessed)
+        self.vocabulary = {}
+        for word in ngram_words:
+            self.vocabulary.setdefault(word, len(self.vocabulary) + 1)
+        self.ngram_base   = len(self.vocabulary) + 1
+        self.ngram_range  = list(ngram_range)
+        word_ids = np.array([self.vocabulary[word] for word in ngram_words], dtype=np.int64)
+        self.ngram_tables = {1: (None, np.bincount(word_ids, minlength=self.ngram_base))}
+        numbers = word_ids
+        for n in range(2, max(self.ngram_range) + 1):
+            keys, numbers, counts = np.unique(numbers[:-1] * self.ngram_base + word_ids[n - 1:],
+                                              return_inverse=True, return_counts=True)
+            self.ngram_tables[n] = (keys, counts)
 
-    # Define an ngram range
-    ngram_range = range(1, 7)
+        # the tokens (get_tokens) as ids of the token vocabulary (ids start at 1); the features compare ids, so the
+        # token strings are kept once, in the vocabulary
+        tokens = get_tokens(source_doc)
+        self.token_vocabulary = {}
+        for token in tokens:
+            self.token_vocabulary.setdefault(token, len(self.token_vocabulary) + 1)
+        self.token_ids    = essay_token_ids(tokens, self.token_vocabulary)
+        self.trigram_keys = trigram_keys(self.token_ids)
+        self.screening_keys = screening_ngram_keys(self.token_ids)
+        # (built from the vocabulary's id objects, so equal ids share one object in the transitions)
+        self.automaton    = SuffixAutomaton([self.token_vocabulary[token] for token in tokens])
+        self.spans        = SpanIndex(source)
+        self.quotations   = QuotationIndex(source)
+        self.index_version = INDEX_VERSION
 
-    # Calculate features for containment for ngrams in range
-    i = 0
-    for n in ngram_range:
-        column_name = 'Containment_' + str(n) + "_score"
-        # create containment features
-        containment_score = calculate_containment(n, input_text, source_text)
-        result_dict[column_name] = containment_score
-        # print(column_name + ": ", containment_score)
-        i += 1
+    @property
+    def tokens(self):
+        '''the token list of the source (get_tokens)'''
+        words = [None] + list(self.token_vocabulary)
+        return [words[token_id] for token_id in self.token_ids]
+
+    @property
+    def trigrams(self):
+        '''the trigram set of the source (get_trigrams)'''
+        return get_trigrams(self.tokens)
+
+    @property
+    def fingerprint(self):
+        '''a hash identifying the features computed against this source (its text and ngram range)'''
+        return hashlib.sha1((repr(self.ngram_range) + self.source_text).encode('utf-8')).hexdigest()
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            index = pickle.load(file)
+        if not isinstance(index, cls):
+            raise TypeError(f'{path} does not contain a {cls.__name__}')
+        return index
+
+
+class SuffixAutomaton:
+    '''
+    Suffix automaton over the token sequence of a source text, for plagiarism algorithm 2.
+    It is built once per source in O(len(source)), after which the longest run of tokens shared with
+    an essay (the value LCS() computes with an O(m*n) matrix) is found in O(len(essay)).
+    '''
+
+    def __init__(self, tokens):
+        # per state: outgoing transitions, suffix link, length of its longest string,
+        # and the source position where that string first ends (to recover match offsets)
+        self.next      = [{}]
+        self.link      = [-1]
+        self.length    = [0]
+        self.first_end = [-1]
+        last = 0
+        for i, token in enumerate(tokens):
+            cur = self._add_state(self.length[last] + 1, i, {})
+            p = last
+            while p != -1 and token not in self.next[p]:
+                self.next[p][token] = cur
+                p = self.link[p]
+            if p == -1:
+                self.link[cur] = 0
+            else:
+                q = self.next[p][token]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[cur] = q
+                else:
+                    clone = self._add_state(self.length[p] + 1, self.first_end[q], dict(self.next[q]))
+                    self.link[clone] = self.link[q]
+                    while p != -1 and self.next[p].get(token) == q:
+                        self.next[p][token] = clone
+                        p = self.link[p]
+                    self.link[q] = clone
+                    self.link[cur] = clone
+            last = cur
+
+    def _add_state(self, length, first_end, transitions):
+        self.next.append(transitions)
+        self.link.append(-1)
+        self.length.append(length)
+        self.first_end.append(first_end)
+        return len(self.length) - 1
+
+    def scan(self, tokens, state=0, length=0):
+        '''
+        Continue the matching of longest_common_run over more tokens, e.g. the next paragraph of an essay
+        :param state, length: where the matching of the tokens before stopped (the start for the first tokens)
+        :return: (state, length, longest): where the matching stops, and the longest run ending in these tokens
+        '''
+        longest = 0
+        for token in tokens:
+            while state != 0 and token not in self.next[state]:
+                state = self.link[state]
+                length = self.length[state]
+            if token in self.next[state]:
+                state = self.next[state][token]
+                length += 1
+            if length > longest:
+                longest = length
+        return state, length, longest
+
+    def longest_common_run(self, tokens, return_spans=False):
+        '''
+        Find the longest run of consecutive tokens that occurs both in the source and in the given tokens.
+        :param tokens: the token list of an essay
+        :param return_spans: also return where the run is in both token lists
+        :return: the run length (same value as LCS(source_tokens, tokens)), or if return_spans is set
+                 (length, (source_start, source_end), (essay_start, essay_end)) with end-exclusive token
+                 offsets, and None for both spans when nothing matches
+        '''
+        state, length = 0, 0
+        longest, longest_end, longest_state = 0, -1, 0
+        for j, token in enumerate(tokens):
+            while state != 0 and token not in self.next[state]:
+                state = self.link[state]
+                length = self.length[state]
+            if token in self.next[state]:
+                state = self.next[state][token]
+                length += 1
+            if length > longest:
+                longest, longest_end, longest_state = length, j, state
+        if not return_spans:
+            return longest
+        if longest == 0:
+            return 0, None, None
+        source_end = self.first_end[longest_state] + 1
+        return longest, (source_end - longest, source_end), (longest_end + 1 - longest, longest_end + 1)
 
-    essay_token  = get_tokens(input_doc)
-    source_token = get_tokens(source_doc)
 
-    essay_trigram  = get_trigrams(essay_token)
-    source_trigram = get_trigrams(source_token)
+# the words of a source or quotation, for matching quotations regardless of case, whitespace and punctuation
+quotation_word_pattern = re.compile(r"\w+")
+# quoted strings between straight or curly quotes (the quotations of Quotation, counted by the screening)
+quotation_pattern = re.compile(r"\"(.*?)\"|“(.*?)”")
 
-    Jaccard_similarity_score  = Jaccard_similarity_coefficient(source_trigram, essay_trigram)
-    Containment_measure_score = containment_measure(source_trigram, essay_trigram)
-    Longest_common_sequence   = LCS(source_token, essay_token)
 
-    result_dict["Jaccard_similarity_score"] = Jaccard_similarity_score
-    result_dict["Containment_measure_score"] = Containment_measure_score
-    result_dict["Longest_common_sequence"] = Longest_common_sequence
-    if len(essay_token) != 0:
-        result_dict["Normed_longest_common_sequence"] = Longest_common_sequence / len(essay_token)
+class QuotationIndex:
+    '''
+    Index of a source text for finding the quotations of essays in it: exact matches (as "quotation in source")
+    and normalized matches, which only need the same words in the same order, ignoring case, whitespace and
+    punctuation. Normalized matches are found with a suffix automaton over the lower-cased words of the source,
+    in time proportional to the length of the quotation rather than of the source.
+    '''
+
+    def __init__(self, source):
+        ''':param source: the raw source text'''
+        self.source_text = source
+        words = list(quotation_word_pattern.finditer(source))
+        # character offsets of the words in the source
+        self.word_spans = [word.span() for word in words]
+        self.automaton  = SuffixAutomaton([word.group().lower() for word in words])
+
+    def find(self, quotation):
+        '''
+        Find a quotation in the source
+        :return: (exact, normalized): the (start, end) character offsets in the source of the first exact match,
+                 and of a normalized match (the exact match if there is one); None where the quotation is not found
+        '''
+        start = self.source_text.find(quotation)
+        if start != -1:
+            return (start, start + len(quotation)), (start, start + len(quotation))
+        words = [word.lower() for word in quotation_word_pattern.findall(quotation)]
+        if not words:
+            return None, None
+        length, source_span, _ = self.automaton.longest_common_run(words, return_spans=True)
+        if length < len(words):
+            return None, None
+        return None, (self.word_spans[source_span[0]][0], self.word_spans[source_span[1] - 1][1])
+
+
+# the number of words of the k-grams that seed a copied span
+span_seed_words = 5
+# the multiplier of the polynomial hash of the word k-grams (computed modulo 2 ** 64)
+span_hash_multiplier = np.uint64(0x9E3779B97F4A7C15)
+
+# a passage of an essay copied from a source: character offsets (end-exclusive) in both texts, and its words
+CopiedSpan = namedtuple('CopiedSpan', ['essay_start', 'essay_end', 'source_start', 'source_end', 'words'])
+
+
+class Alignment(namedtuple('Alignment', ['spans', 'essay_words', 'copied_words', 'source_words',
+                                         'copied_source_words'])):
+    '''
+    The copied spans of an essay (see SpanIndex.align), with the number of words of the essay and the source
+    and how many of them are in a span
+    '''
+    __slots__ = ()
+
+    @property
+    def copied_ratio(self):
+        '''the share of the essay words in a copied span (0 for an essay without words)'''
+        return self.copied_words / self.essay_words if self.essay_words else 0.0
+
+    @property
+    def source_coverage(self):
+        '''the share of the source words in a copied span'''
+        return self.copied_source_words / self.source_words if self.source_words else 0.0
+
+
+def kgram_hashes(ids, k):
+    '''
+    Hash the word k-grams of a sequence of word ids into 64-bit keys
+    :param ids: a numpy array of word ids
+    :return: a numpy uint64 array with the key of the k-gram starting at each position (len(ids) - k + 1 keys)
+    '''
+    if len(ids) < k:
+        return np.empty(0, dtype=np.uint64)
+    ids  = ids.astype(np.uint64)
+    keys = np.zeros(len(ids) - k + 1, dtype=np.uint64)
+    for j in range(k):
+        keys = keys * span_hash_multiplier + ids[j:len(ids) - k + 1 + j]
+    return keys
+
+
+def span_word_ids(text, vocabulary):
+    '''
+    :return: (words, ids): the word matches of a text for the copied spans (lower-cased \\w+ runs), and their ids
+             in a word vocabulary (0 for the words not in it), as a numpy uint32 array
+    '''
+    words = list(quotation_word_pattern.finditer(text))
+    return words, np.array([vocabulary.get(word.group().lower(), 0) for word in words], dtype=np.uint32)
+
+
+class SpanIndex:
+    '''
+    Hash index of the word k-grams of a source text, for finding the passages an essay copied from it (seed and
+    extend): the essay k-grams found in the index seed matches, which are extended word by word into maximal
+    copied spans, in time about linear in the length of the essay (instead of comparing every passage with the
+    O(m*n) LCS() matrix). Words are the lower-cased \\w+ runs of the raw texts, stop words included, so spans map
+    back to character offsets in both texts.
+    '''
+
+    def __init__(self, source, k=span_seed_words):
+        '''
+        :param source: the raw source text
+        :param k: the number of words of the seeds, the shortest copied span
+        '''
+        words = list(quotation_word_pattern.finditer(source))
+        self.k          = k
+        self.vocabulary = {}
+        self.word_ids   = array('I', [self.vocabulary.setdefault(word.group().lower(), len(self.vocabulary) + 1)
+                                      for word in words])
+        self.word_starts = array('q', [word.start() for word in words])
+        self.word_ends   = array('q', [word.end() for word in words])
+        # the positions of the source k-grams, sorted by their keys
+        keys = kgram_hashes(np.frombuffer(self.word_ids, dtype=np.uint32), k)
+        self.positions = np.argsort(keys, kind='stable')
+        self.keys      = keys[self.positions]
+
+    def align(self, essay_text, max_candidates=64):
+        '''
+        Find the passages of an essay copied from the source: going through the essay, each k-gram that is in
+        the source (and not in a span found before) is extended forwards and backwards along its source
+        occurrences, and the longest extension is a copied span
+        :param max_candidates: the most source occurrences of a k-gram that are extended (for very repetitive
+                               sources)
+        :return: an Alignment, with the CopiedSpans in essay order (they do not overlap in the essay)
+        '''
+        words, ids = span_word_ids(essay_text, self.vocabulary)
+        spans, source_runs = [], []
+        if len(ids) >= self.k and len(self.word_ids) >= self.k:
+            keys = kgram_hashes(ids, self.k)
+            # a k-gram with a word that is not in the source (id 0) is not in it either
+            known = ~np.lib.stride_tricks.sliding_window_view(ids == 0, self.k).any(axis=1)
+            low   = np.searchsorted(self.keys, keys, 'left')
+            high  = np.searchsorted(self.keys, keys, 'right')
+            seeds = np.flatnonzero(known & (high > low)).tolist()
+            essay_ids, source_ids = ids.tolist(), self.word_ids
+            essay_length, source_length = len(essay_ids), len(source_ids)
+            end = 0
+            for i in seeds:
+                if i < end:
+                    continue
+                best_length, best_start, best_source_start = 0, 0, 0
+                for s in self.positions[low[i]:min(high[i], low[i] + max_candidates)].tolist():
+                    length = 0
+                    while i + length < essay_length and s + length < source_length \
+                            and essay_ids[i + length] == source_ids[s + length]:
+                        length += 1
+                    if length < self.k:
+                        # the same key for another k-gram
+                        continue
+                    back = 0
+                    while i - back > end and s - back > 0 and essay_ids[i - back - 1] == source_ids[s - back - 1]:
+                        back += 1
+                    if back + length > best_length:
+                        best_length, best_start, best_source_start = back + length, i - back, s - back
+                if best_length:
+                    end = best_start + best_length
+                    source_runs.append((best_source_start, best_length))
+                    spans.append(CopiedSpan(words[best_start].start(), words[end - 1].end(),
+                                            self.word_starts[best_source_start],
+                                            self.word_ends[best_source_start + best_length - 1], best_length))
+        # the source words in at least one span (the spans may overlap in the source)
+        copied_source_words, covered_end = 0, 0
+        for start, length in sorted(source_runs):
+            copied_source_words += max(start + length - max(start, covered_end), 0)
+            covered_end = max(covered_end, start + length)
+        return Alignment(spans, len(ids), sum(span.words for span in spans), len(self.word_ids), copied_source_words)
+
+
+class SourceLibrary:
+    '''
+    A collection of named sources (e.g. the articles of a prompt, or a library of past readings) with an
+    inverted ngram index over all of them. An essay is matched once against the index, so its cost grows
+    with the essay and the ngrams it actually shares with sources, not with the number of sources.
+    A library is accepted by plagiarism_features and quotation_features wherever a SourceIndex is.
+    '''
+
+    # ngram keys of the library use a fixed base, so adding sources does not change existing keys
+    ngram_base = 1 << 32
+
+    def __init__(self, per_source_columns=True):
+        '''
+        :param per_source_columns: also report the features of every single source (one column per source
+                                   and feature), instead of only the best-source columns
+        '''
+        self.per_source_columns = per_source_columns
+        self.names      = []
+        self.sources    = []
+        self.vocabulary = {}
+        # postings: ngram key -> [(source number, count)] for the containment scores,
+        # and token id / token id bigram key / trigram key -> [source number] for Jaccard, containment measure and
+        # LCS, over the ids of a token vocabulary shared by all sources
+        self.ngram_postings   = None
+        self.token_vocabulary = {}
+        self.token_postings   = {}
+        self.bigram_postings  = {}
+        self.trigram_postings = {}
+        # the screening ngram keys of all sources, over the ids of the token vocabulary
+        self.screening_keys   = np.empty(0, dtype=np.uint64)
+        # lower-cased word -> [source number], to narrow down the sources that can contain a quotation
+        self.quotation_word_postings = {}
+        # word k-gram key (over the ids of a word vocabulary shared by all sources) -> [source number], to narrow
+        # down the sources an essay can have copied spans from
+        self.span_vocabulary = {}
+        self.span_postings   = {}
+        self.index_version = INDEX_VERSION
+
+    def add(self, name, source):
+        '''
+        Add a source to the library.
+        :param name: the name of the source, used in the per-source column names
+        :param source: a SourceIndex
+        '''
+        if name in self.names:
+            raise ValueError(f'a source named {name!r} is already in the library')
+        if self.ngram_postings is None:
+            self.ngram_postings = {n: {} for n in source.ngram_range}
+        elif source.ngram_range != self.ngram_range:
+            raise ValueError('all sources of a library need the same ngram range')
+        if source.spans.k != span_seed_words:
+            raise ValueError(f'the copied spans of the sources of a library are seeded with {span_seed_words} words')
+        number = len(self.sources)
+        self.names.append(name)
+        self.sources.append(source)
+
+        token_ids = [self.vocabulary.setdefault(word, len(self.vocabulary) + 1)
+                     for word in ngram_tokens(source.preprocessed)]
+        ngram_counts = Counter(rolling_ngram_keys(token_ids, self.ngram_base, max(self.ngram_range)))
+        for (n, key), count in ngram_counts.items():
+            if n in self.ngram_postings:
+                self.ngram_postings[n].setdefault(key, []).append((number, count))
+
+        for token in source.token_vocabulary:
+            self.token_vocabulary.setdefault(token, len(self.token_vocabulary) + 1)
+        source_ids = essay_token_ids(source.tokens, self.token_vocabulary)
+        for token_id in set(source_ids):
+            self.token_postings.setdefault(token_id, []).append(number)
+        for bigram in set(bigram_keys(source_ids)):
+            self.bigram_postings.setdefault(bigram, []).append(number)
+        for trigram in trigram_keys(source_ids).tolist():
+            self.trigram_postings.setdefault(trigram, []).append(number)
+        self.screening_keys = np.union1d(self.screening_keys, screening_ngram_keys(source_ids))
+        for word in {word.lower() for word in quotation_word_pattern.findall(source.source_text)}:
+            self.quotation_word_postings.setdefault(word, []).append(number)
+        # the source word ids mapped to the shared word vocabulary
+        library_ids = np.array([0] + [self.span_vocabulary.setdefault(word, len(self.span_vocabulary) + 1)
+                                      for word in source.spans.vocabulary], dtype=np.uint32)
+        source_ids  = library_ids[np.frombuffer(source.spans.word_ids, dtype=np.uint32)]
+        for key in np.unique(kgram_hashes(source_ids, span_seed_words)).tolist():
+            self.span_postings.setdefault(key, []).append(number)
+
+    @classmethod
+    def from_sources(cls, sources, per_source_columns=True):
+        ''':param sources: a dict of {name: SourceIndex}'''
+        library = cls(per_source_columns)
+        for name, source in sources.items():
+            library.add(name, source)
+        return library
+
+    @property
+    def ngram_range(self):
+        return list(self.ngram_postings) if self.ngram_postings is not None else []
+
+    @property
+    def source_texts(self):
+        return {name: source.source_text for name, source in zip(self.names, self.sources)}
+
+    @property
+    def fingerprint(self):
+        '''a hash identifying the features computed against this library (its sources and columns)'''
+        key = repr([(name, source.fingerprint) for name, source in zip(self.names, self.sources)])
+        return hashlib.sha1((repr(self.per_source_columns) + key).encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self.sources)
+
+    def containment_scores(self, essay_text):
+        '''
+        The containment_scores() of the essay against every source, from one pass over the essay.
+        :return: a dict of {n: (scores, default)}, where scores is a dict of {source number: containment value}
+                 for the sources sharing an ngram of size n with the essay, and default the value of all other
+                 sources (0.0, or nan as in containment_scores() when the essay has no ngram of size n)
+        '''
+        token_ids = ngram_token_ids(essay_text, self.vocabulary)
+        essay_counts = Counter(rolling_ngram_keys(token_ids, self.ngram_base, max(self.ngram_range)))
+
+        intersection = {n: Counter() for n in self.ngram_range}
+        for (n, key), count in essay_counts.items():
+            if n in intersection:
+                for number, source_count in self.ngram_postings[n].get(key, ()):
+                    intersection[n][number] += min(count, source_count)
+
+        scores = {}
+        for n in self.ngram_range:
+            total_ngram_a = len(token_ids) - n + 1
+            if total_ngram_a > 0:
+                scores[n] = ({number: shared / total_ngram_a for number, shared in intersection[n].items()}, 0.0)
+            else:
+                scores[n] = ({}, float('nan'))
+        return scores
+
+    def longest_common_runs(self, essay_token, essay_ids, essay_trigram):
+        '''
+        The longest common sequence of the essay with every source that shares a token with it.
+        Only sources sharing a trigram can have a run of 3 or more tokens, so only their suffix automata are
+        queried; runs of 1 or 2 tokens follow from the token and bigram postings.
+        :param essay_ids: the essay_token_ids() of the essay tokens in the library vocabulary
+        :param essay_trigram: their trigram_keys()
+        :return: a dict of {source number: run length} (0 for the sources not in it)
+        '''
+        runs = {}
+        for token_id in set(essay_ids):
+            for number in self.token_postings.get(token_id, ()):
+                runs[number] = 1
+        for bigram in set(bigram_keys(essay_ids)):
+            for number in self.bigram_postings.get(bigram, ()):
+                runs[number] = 2
+        candidates = {number for trigram in essay_trigram.tolist()
+                      for number in self.trigram_postings.get(trigram, ())}
+        for number in candidates:
+            source = self.sources[number]
+            runs[number] = source.automaton.longest_common_run(essay_token_ids(essay_token, source.token_vocabulary))
+        return runs
+
+    def copied_spans(self, essay_text):
+        '''
+        The copied spans of the essay from every source that shares a word k-gram with it (see SpanIndex.align)
+        :return: a dict of {source number: Alignment} (the sources not in it have no copied span)
+        '''
+        _, ids = span_word_ids(essay_text, self.span_vocabulary)
+        keys = kgram_hashes(ids, span_seed_words)
+        if len(keys):
+            keys = keys[~np.lib.stride_tricks.sliding_window_view(ids == 0, span_seed_words).any(axis=1)]
+        candidates = {number for key in np.unique(keys).tolist() for number in self.span_postings.get(key, ())}
+        return {number: self.sources[number].spans.align(essay_text) for number in sorted(candidates)}
+
+    def quotation_matches(self, quotation):
+        '''
+        Find a quotation in the sources (see QuotationIndex.find).
+        Sources are first narrowed to those containing the words of the quotation that are whole words in any
+        match (all but its first and last words, which an exact match may only partly cover).
+        :return: a dict of {source number: (exact, normalized)} of the sources the quotation is found in
+        '''
+        candidates = range(len(self.sources))
+        for word in set(word.lower() for word in quotation_word_pattern.findall(quotation)[1:-1]):
+            candidates = set(self.quotation_word_postings.get(word, ())).intersection(candidates)
+        matches = {}
+        for number in sorted(candidates):
+            exact, normalized = self.sources[number].quotations.find(quotation)
+            if normalized is not None:
+                matches[number] = (exact, normalized)
+        return matches
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            library = pickle.load(file)
+        if not isinstance(library, cls):
+            raise TypeError(f'{path} does not contain a {cls.__name__}')
+        return library
+
+
+# the number of tokens of the ngrams of the screening overlap
+screening_ngram_size = 6
+
+
+def screening_ngram_keys(ids):
+    '''the sorted distinct kgram_hashes() of the screening ngrams of a sequence of token ids (an array('I'))'''
+    return np.unique(kgram_hashes(np.frombuffer(ids, dtype=np.uint32), screening_ngram_size))
+
+
+def screening_features(screening, input, essay_ids, screening_keys, containment_measure):
+    '''
+    Screen an essay (see Screening.Screening.screen)
+    :param screening: the Screening thresholds, or None to give every essay the full features
+    :return: (full, result_dict): whether the essay gets the full tier, and the dict of its SCREENING_COLUMNS
+             (empty without screening)
+    '''
+    if screening is None:
+        return True, {}
+    return screening.screen(input, essay_ids, screening_keys, containment_measure)
+
+
+def trigram_similarity(shared, essay_trigrams, source_trigrams):
+    '''
+    The values of Jaccard_similarity_coefficient() and containment_measure() from the trigram counts
+    :param shared: the number of trigrams the essay shares with the source
+    :param essay_trigrams: the number of trigrams of the essay
+    :param source_trigrams: the number of trigrams of the source
+    :return: (Jaccard similarity, containment measure), each 0 where it would divide by zero (neither text has a
+             trigram, or the essay has none)
+    '''
+    union = source_trigrams + essay_trigrams - shared
+    return shared / union if union != 0 else 0.0, shared / essay_trigrams if essay_trigrams != 0 else 0
+
+
+def plagiarism_result(containment, trigram_scores, longest_common_sequence, copied_spans, essay_tokens=None):
+    '''
+    The result dictionary of the plagiarism features of an essay, in the order of the output columns
+    :param containment: a dict of {n: containment score} (None scores where they were not computed)
+    :param trigram_scores: (Jaccard similarity, containment measure), see trigram_similarity
+    :param longest_common_sequence: the longest common sequence (None where it was not computed)
+    :param copied_spans: (number of copied spans, share of the essay tokens copied), or None where they were not
+                         computed
+    :param essay_tokens: the number of tokens of the essay, for the normed longest common sequence ("N/A" for an
+                         essay without tokens); None leaves that column out
+    :return: the result dictionary
+    '''
+    result_dict = {}
+    for n, containment_score in containment.items():
+        result_dict['Containment_' + str(n) + "_score"] = containment_score
+    result_dict["Jaccard_similarity_score"], result_dict["Containment_measure_score"] = trigram_scores
+    result_dict["Longest_common_sequence"] = longest_common_sequence
+    if essay_tokens is None:
+        pass
+    elif longest_common_sequence is None:
+        result_dict["Normed_longest_common_sequence"] = None
+    elif essay_tokens != 0:
+        result_dict["Normed_longest_common_sequence"] = longest_common_sequence / essay_tokens
     else:
         result_dict["Normed_longest_common_sequence"] = "N/A"
+    result_dict["Copied_span_count"], result_dict["Copied_token_ratio"] = copied_spans or (None, None)
+    return result_dict
+
+
+def corpus_containment_scores(essay_texts, source, ngram_range=None):
+    '''
+    The containment_scores() of a whole corpus of essays against a source, in one vectorized pass per ngram size:
+    the words of all essays are mapped to the source vocabulary, the ngrams of size n to the source ngram numbers
+    (see SourceIndex), and their counts form a sparse essay x source ngram matrix. Clipping each count
+    at the source count and summing the rows gives the intersection of every essay with the source.
+    :param essay_texts: a list of preprocessed essay texts
+    :param source: a SourceIndex
+    :param ngram_range: the ngram sizes to score, a subset of source.ngram_range (default: all of them)
+    :return: a dict of {n: list of the containment values of the essays}, the same values as containment_scores()
+    '''
+    # for plagiarism algorithm 1
+    # (imported here: scipy.sparse takes a while to import, and only the corpus functions use it)
+    from scipy.sparse import csr_matrix
+    ngram_range = source.ngram_range if ngram_range is None else list(ngram_range)
+    vocabulary = source.vocabulary
+
+    # the word ids of all essays, each essay followed by a 0 so that no ngram spans two essays
+    essay_ids, lengths = array('I'), []
+    for essay_text in essay_texts:
+        token_ids = ngram_token_ids(essay_text, vocabulary)
+        essay_ids.extend(token_ids)
+        essay_ids.append(0)
+        lengths.append(len(token_ids))
+    word_ids = np.array(essay_ids, dtype=np.int64)
+    lengths  = np.array(lengths, dtype=np.int64)
+    rows = np.repeat(np.arange(len(lengths)), lengths + 1)
+
+    scores = {}
+    for n, numbers in source_ngram_numbers(word_ids, source, max(ngram_range)):
+        if n not in ngram_range:
+            continue
+        source_counts = source.ngram_tables[n][1]
+        matched = numbers >= 0
+        counts = csr_matrix((np.ones(matched.sum(), dtype=np.int64), (rows[:len(numbers)][matched], numbers[matched])),
+                            shape=(len(lengths), len(source_counts)))
+        counts.sum_duplicates()
+        # count each essay ngram at most as often as it occurs in the source: sum of min(count_a, count_b)
+        counts.data = np.minimum(counts.data, source_counts[counts.indices])
+        intersection = np.asarray(counts.sum(axis=1)).ravel()
+        total_ngram_a = lengths - n + 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores[n] = np.where(total_ngram_a > 0, intersection / total_ngram_a, np.nan).tolist()
+    return scores
+
+
+def corpus_trigram_scores(essay_ids, source):
+    '''
+    The trigram similarity of a whole corpus of essays against a source: the essay trigrams found in the source
+    form a sparse essay x source trigram matrix, whose row sums are the shared trigrams of each essay.
+    :param essay_ids: a list of the essay_token_ids() of each essay (in source.token_vocabulary)
+    :param source: a SourceIndex
+    :return: a list of the (Jaccard similarity, containment measure) of each essay (see trigram_similarity)
+    '''
+    # for plagiarism algorithm 2
+    from scipy.sparse import csr_matrix
+    source_trigram = source.trigram_keys
+    rows, found, essay_sizes = [], [], []
+    for row, ids in enumerate(essay_ids):
+        # the column of each essay trigram is its position among the sorted source trigram keys
+        essay_trigram = trigram_keys(ids)
+        columns = np.searchsorted(source_trigram, essay_trigram)
+        in_source = columns < len(source_trigram)
+        in_source[in_source] = source_trigram[columns[in_source]] == essay_trigram[in_source]
+        rows.append(np.full(in_source.sum(), row))
+        found.append(columns[in_source])
+        essay_sizes.append(len(essay_trigram))
+    shared_matrix = csr_matrix((np.ones(sum(map(len, found)), dtype=np.int64),
+                                (np.concatenate(rows), np.concatenate(found))),
+                               shape=(len(essay_ids), len(source_trigram)))
+    shared = np.asarray(shared_matrix.sum(axis=1)).ravel().astype(np.int64)
+    return [trigram_similarity(count, size, len(source_trigram))
+            for count, size in zip(shared.tolist(), essay_sizes)]
+
+
+def corpus_plagiarism_features(inputs, input_docs, source, screening=None):
+    '''
+    The plagiarism_features() of a whole corpus of essays, with the containment and trigram scores computed
+    for all essays at once (see corpus_containment_scores and corpus_trigram_scores)
+    :param inputs: the raw essay texts
+    :param input_docs: their spaCy Docs (or doc_tokens())
+    :param source: a SourceIndex (a SourceLibrary scores the essays one at a time)
+    :param screening: the Screening thresholds (see plagiarism_features); the containment scores are computed for
+                      the essays of the full tier only
+    :return: a list of the result dictionaries of the essays
+    '''
+    if not isinstance(source, SourceIndex) or not inputs:
+        return [plagiarism_features(input, input_doc, source, screening=screening)
+                for input, input_doc in zip(inputs, input_docs)]
+    essay_tokens = [get_tokens(input_doc) for input_doc in input_docs]
+    essay_ids    = [essay_token_ids(essay_token, source.token_vocabulary) for essay_token in essay_tokens]
+    trigram_scores = corpus_trigram_scores(essay_ids, source)
+    screened = [screening_features(screening, input, ids, source.screening_keys, containment_measure)
+                for input, ids, (_, containment_measure) in zip(inputs, essay_ids, trigram_scores)]
+    full_inputs = [string_preprocessing(input) for input, (full, _) in zip(inputs, screened) if full]
+    containment = iter(zip(*corpus_containment_scores(full_inputs, source).values())) if full_inputs else iter(())
+
+    result_dicts = []
+    for i, essay_token in enumerate(essay_tokens):
+        full, screening_dict = screened[i]
+        if full:
+            alignment   = source.spans.align(inputs[i])
+            result_dict = plagiarism_result(dict(zip(source.ngram_range, next(containment))), trigram_scores[i],
+                                            source.automaton.longest_common_run(essay_ids[i]),
+                                            (len(alignment.spans), alignment.copied_ratio), len(essay_token))
+        else:
+            result_dict = plagiarism_result(dict.fromkeys(source.ngram_range), trigram_scores[i], None, None,
+                                            len(essay_token))
+        result_dict.update(screening_dict)
+        result_dicts.append(result_dict)
+    return result_dicts
+
+
+def library_plagiarism_features(input_text, essay_token, library, input, screening=None):
+    '''
+    The plagiarism features of an essay against a SourceLibrary (see plagiarism_features); input is the raw
+    essay text, for the copied spans and the screening.
+    The original columns hold the best value over all sources for each feature, "Best_source" names the source
+    with the highest containment measure ("N/A" if no source shares a trigram with the essay), and with
+    library.per_source_columns every source adds its own columns, named "<column>_<source name>". The screening
+    signals are those of the best source (the containment measure), or of the sources together (the ngram overlap).
+    '''
+    with stage('plagiarism.trigrams'):
+        essay_ids     = essay_token_ids(essay_token, library.token_vocabulary)
+        essay_trigram = trigram_keys(essay_ids)
+        shared_counts = Counter(number for trigram in essay_trigram.tolist()
+                                for number in library.trigram_postings.get(trigram, ()))
+    with stage('plagiarism.screening'):
+        best_shared = max(shared_counts.values(), default=0)
+        full, screening_dict = screening_features(screening, input, essay_ids, library.screening_keys,
+                                                  best_shared / len(essay_trigram) if len(essay_trigram) != 0 else 0)
+
+    if full:
+        with stage('plagiarism.containment'):
+            containment = library.containment_scores(input_text)
+        with stage('plagiarism.longest_common_sequence'):
+            runs = library.longest_common_runs(essay_token, essay_ids, essay_trigram)
+        with stage('plagiarism.copied_spans'):
+            alignments = library.copied_spans(input)
+    else:
+        containment = {n: ({}, None) for n in library.ngram_range}
+        runs = alignments = None
+
+    # the columns of each source (without the normed longest common sequence, which is that of the best value)
+    per_source = []
+    for number, source in enumerate(library.sources):
+        trigram_scores = trigram_similarity(shared_counts.get(number, 0), len(essay_trigram), len(source.trigram_keys))
+        if full:
+            alignment = alignments.get(number)
+            copied_spans = (len(alignment.spans), alignment.copied_ratio) if alignment is not None else (0, 0.0)
+            source_dict = plagiarism_result({n: scores.get(number, default) for n, (scores, default) in
+                                             containment.items()}, trigram_scores, runs.get(number, 0), copied_spans)
+        else:
+            source_dict = plagiarism_result(dict.fromkeys(containment), trigram_scores, None, None)
+        per_source.append(source_dict)
+
+    def best(column):
+        return max((source_dict[column] for source_dict in per_source), default=0)
+    trigram_scores = (best("Jaccard_similarity_score"), best("Containment_measure_score"))
+    best_containment = {n: max(scores.values(), default=default) for n, (scores, default) in containment.items()}
+    if full:
+        result_dict = plagiarism_result(best_containment, trigram_scores, best("Longest_common_sequence"),
+                                        (best("Copied_span_count"), best("Copied_token_ratio")), len(essay_token))
+    else:
+        result_dict = plagiarism_result(best_containment, trigram_scores, None, None, len(essay_token))
+    best_number = max(range(len(per_source)), key=lambda number: per_source[number]["Containment_measure_score"],
+                      default=None)
+    if best_number is not None and per_source[best_number]["Containment_measure_score"] > 0:
+        result_dict["Best_source"] = library.names[best_number]
+    else:
+        result_dict["Best_source"] = "N/A"
+    result_dict.update(screening_dict)
+
+    if library.per_source_columns:
+        for name, source_dict in zip(library.names, per_source):
+            for column, value in source_dict.items():
+                result_dict[column + '_' + name] = value
+    return result_dict
+
+
+def plagiarism_features(input, input_doc, source, source_doc=None, screening=None):
+    '''
+    :param source: the raw source text (with its spaCy Doc as source_doc), a SourceIndex built from them,
+                   or a SourceLibrary of several sources (see library_plagiarism_features)
+    :param screening: the Screening thresholds, to compute the containment scores, the longest common sequence and
+                      the copied spans only for the essays that reach one (None computes them for every essay)
+    '''
+
+    input_text = string_preprocessing(input)
+
+    if isinstance(source, SourceLibrary):
+        return library_plagiarism_features(input_text, get_tokens(input_doc), source, input, screening)
+    if not isinstance(source, SourceIndex):
+        source = SourceIndex(source, source_doc)
+
+    essay_token  = get_tokens(input_doc)
+    essay_ids    = essay_token_ids(essay_token, source.token_vocabulary)
+
+    with stage('plagiarism.trigrams'):
+        # the trigram sets as trigram keys: the values of Jaccard_similarity_coefficient and containment_measure
+        essay_trigram  = trigram_keys(essay_ids)
+        source_trigram = source.trigram_keys
+        shared = shared_trigrams(source_trigram, essay_trigram)
+        trigram_scores = trigram_similarity(shared, len(essay_trigram), len(source_trigram))
+    with stage('plagiarism.screening'):
+        full, screening_dict = screening_features(screening, input, essay_ids, source.screening_keys,
+                                                  trigram_scores[1])
+
+    if full:
+        # Calculate features for containment for all ngrams in range in one pass
+        with stage('plagiarism.containment'):
+            containment = containment_scores(input_text, source)
+        with stage('plagiarism.longest_common_sequence'):
+            Longest_common_sequence = source.automaton.longest_common_run(essay_ids)
+        with stage('plagiarism.copied_spans'):
+            alignment = source.spans.align(input)
+        copied_spans = (len(alignment.spans), alignment.copied_ratio)
+    else:
+        containment = dict.fromkeys(source.ngram_range)
+        Longest_common_sequence = copied_spans = None
+
+    result_dict = plagiarism_result(containment, trigram_scores, Longest_common_sequence, copied_spans,
+                                    len(essay_token))
+    result_dict.update(screening_dict)
     # print(result_dict)
 
     return result_dict
@@ -0,0 +1,174 @@
+import json, time, tracemalloc
+import numpy as np
+
+# The stages of the scoring of an essay: the spaCy parse, each feature group, and the parts of each group
+PROFILE_STAGES = ['parse',
+                  'citation', 'citation.scan', 'citation.sentence_position', 'citation.word_position',
+                  'citation.char_position', 'citation.coverage',
+                  'plagiarism', 'plagiarism.containment', 'plagiarism.trigrams', 'plagiarism.longest_common_sequence',
+                  'plagiarism.copied_spans', 'plagiarism.screening',
+                  'quotation', 'quotation.matching']
+
+# the stages of the essay being profiled in this process: stage -> [seconds, peak bytes]
+# (None when profiling is off), whether allocations are traced, and the peaks of the enclosing stages
+_stages = None
+_memory = False
+_peaks  = []
+
+
+class _NoStage:
+    # what stage() returns when profiling is off: entering and leaving it does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'start', 'memory_start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _memory:
+            # the peak so far belongs to the enclosing stage; measure this one from here
+            current, peak = tracemalloc.get_traced_memory()
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            _peaks.append(0)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        entry = _stages.setdefault(self.name, [0.0, 0])
+        entry[0] += seconds
+        if _memory:
+            peak = max(tracemalloc.get_traced_memory()[1], _peaks.pop())
+            if _peaks:
+                _peaks[-1] = max(_peaks[-1], peak)
+            tracemalloc.reset_peak()
+            entry[1] = max(entry[1], peak - self.memory_start)
+        return False
+
+
+def stage(name):
+    '''
+    Time a stage of the scoring of an essay, when profiling is on (see start_essay):
+        with stage('plagiarism.containment'):
+            ...
+    When profiling is off this costs one function call.
+    '''
+    if _stages is None:
+        return _no_stage
+    return _Stage(name)
+
+
+def start_essay(memory=False):
+    '''
+    Start profiling the scoring of an essay in this process
+    :param memory: also trace the allocations of each stage (with tracemalloc, which slows the scoring down)
+    '''
+    global _stages, _memory
+    _stages = {}
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def finish_essay():
+    '''
+    Stop profiling the essay
+    :return: a dict of {stage: [seconds, peak bytes]} (peak bytes are 0 without memory tracing)
+    '''
+    global _stages
+    stages, _stages = _stages, None
+    _peaks.clear()
+    return stages
+
+
+class Profiler:
+    '''
+    Collects the stage profiles of the essays of a run (see Batch.score_texts), writes them to a JSON-lines
+    trace and/or as extra output columns ("time_<stage>" in seconds, and "peak_memory_<stage>" in bytes when
+    allocations are traced), and summarizes them per stage, flagging outlier essays.
+    '''
+
+    def __init__(self, trace_path=None, columns=False, memory=False):
+        '''
+        :param trace_path: path of the JSON-lines trace (one line per essay), or None
+        :param columns: add the stage profiles to the feature dicts
+        :param memory: also trace the peak memory of each stage
+        '''
+        self.trace_path = trace_path
+        self.columns    = columns
+        self.memory     = memory
+        self.filenames  = []
+        # per stage, the seconds of every essay (0 where the stage did not run, e.g. a cached feature group)
+        self.seconds    = {stage: [] for stage in PROFILE_STAGES}
+        self._trace = open(trace_path, 'a', encoding='utf-8') if trace_path else None
+
+    def record(self, filename, stages):
+        '''
+        record the stages of an essay
+        :return: the profile columns of the essay (empty unless columns is set)
+        '''
+        self.filenames.append(filename)
+        for name in PROFILE_STAGES:
+            self.seconds[name].append(stages[name][0] if name in stages else 0.0)
+        if self._trace is not None:
+            entry = {'Filename': filename,
+                     'stages': {name: ({'seconds': seconds, 'peak_bytes': peak} if self.memory
+                                       else {'seconds': seconds}) for name, (seconds, peak) in stages.items()}}
+            self._trace.write(json.dumps(entry) + '\n')
+        if not self.columns:
+            return {}
+        profile_dict = {}
+        for name in PROFILE_STAGES:
+            profile_dict['time_' + name] = stages[name][0] if name in stages else 0.0
+            if self.memory:
+                profile_dict['peak_memory_' + name] = stages[name][1] if name in stages else 0
+        return profile_dict
+
+    def summary(self, outlier_factor=5.0):
+        '''
+        :param outlier_factor: an essay is an outlier in a stage if the stage took longer than the 95th percentile
+                               and more than outlier_factor times the median
+        :return: a dict of {stage: {'p50', 'p95', 'max' (in seconds), 'outliers' (the filenames)}}
+                 for the stages that ran
+        '''
+        summary = {}
+        for name, seconds in self.seconds.items():
+            if not any(seconds):
+                continue
+            seconds = np.array(seconds)
+            p50, p95 = np.percentile(seconds, [50, 95])
+            outliers = [self.filenames[i] for i in np.flatnonzero((seconds > p95) & (seconds > outlier_factor * p50))]
+            summary[name] = {'p50': p50, 'p95': p95, 'max': seconds.max(), 'outliers': outliers}
+        return summary
+
+    def format_summary(self, outlier_factor=5.0):
+        '''the summary as a table'''
+        lines = [f"{'stage':<38}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}  outliers"]
+        for name, values in self.summary(outlier_factor).items():
+            lines.append(f"{name:<38}{values['p50'] * 1000:>10.2f}{values['p95'] * 1000:>10.2f}"
+                         f"{values['max'] * 1000:>10.2f}  {', '.join(values['outliers'][:5])}"
+                         + (f" (+{len(values['outliers']) - 5})" if len(values['outliers']) > 5 else ''))
+        return '\n'.join(lines)
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
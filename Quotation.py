@@ -1,15 +1,80 @@
 import re
+from collections import namedtuple
+from Plagiarism import SourceIndex, SourceLibrary, QuotationIndex, quotation_pattern
+from Profiling import stage
+
+# Version of the features of this module; increase it when a change alters their values (invalidates cached results)
+FEATURE_VERSION = 2
+# The columns of quotation_features (a SourceLibrary adds the per-source columns "<column>_<source name>")
+FEATURE_COLUMNS = ['number_of_quoted_words', 'ratio_of_quoted_words', 'number_quotations_from_source',
+                   'percentage_quotations_from_source', 'number_quotations_from_source_normalized',
+                   'percentage_quotations_from_source_normalized']
+# The dtypes of the columns in a typed result table (see Results.ResultTable)
+FEATURE_DTYPES = {column: 'int32' if column.startswith('number_') else 'float64' for column in FEATURE_COLUMNS}
+
+# quoted strings between straight quotes (the quotations of the original columns); quotation_pattern also matches
+# curly quotes
+straight_quotation_pattern = re.compile(r"[\"](.*?)[\"]")
+
+# a quotation of an essay: its text and (start, end) offsets in the essay (without the quotes), and the sources
+# it is found in, as {source number: (exact, normalized)} source offsets (see QuotationIndex.find);
+# a single source has the number 0
+QuotationMatch = namedtuple('QuotationMatch', ['text', 'start', 'end', 'sources'])
+
+
+def quotation_index(source):
+    '''
+    :param source: the raw source text, a SourceIndex or a SourceLibrary
+    :return: the QuotationIndex of the source (a SourceIndex builds it once for all essays), or the SourceLibrary
+    '''
+    if isinstance(source, SourceIndex):
+        return source.quotations
+    if isinstance(source, str):
+        return QuotationIndex(source)
+    return source
+
+
+def quotation_sources(quotation, source):
+    '''
+    :param source: a QuotationIndex or SourceLibrary (see quotation_index)
+    :return: a dict of {source number: (exact, normalized)} of the sources the quotation is found in
+    '''
+    if isinstance(source, SourceLibrary):
+        return source.quotation_matches(quotation)
+    exact, normalized = source.find(quotation)
+    return {0: (exact, normalized)} if normalized is not None else {}
+
+
+def match_quotations(input, source):
+    '''
+    This function finds the quotations of an essay (between straight or curly quotes) in the source texts,
+    exactly or with normalized case, whitespace and punctuation
+    :param source: the raw source text, a SourceIndex or a SourceLibrary
+    :return: a list of QuotationMatch, in essay order
+    '''
+    source = quotation_index(source)
+    quotation_list = []
+    for match in quotation_pattern.finditer(input):
+        group = 1 if match.group(1) is not None else 2
+        quotation = match.group(group)
+        quotation_list.append(QuotationMatch(quotation, match.start(group), match.end(group),
+                                             quotation_sources(quotation, source)))
+    return quotation_list
+
 
 def quotation_features(input, input_doc, source):
     '''
     This fuction calculates the number and frequency of quotations
     and the number and percentage of quotations from the source texts
+    :param source: the raw source text, a SourceIndex built from it, or a SourceLibrary (a quotation then counts
+                   as from the source if any source contains it; with library.per_source_columns every source also
+                   gets its own columns, named "<column>_<source name>")
     :return: None (the function adds in the frequency info to the feature dict)
     '''
 
     result_dict = {}
     # identify quoted strings
-    quotation_list   = re.findall(r"[\"](.*?)[\"]", input)
+    quotation_list   = straight_quotation_pattern.findall(input)
     quotation_str    = " ".join(quotation_list)
     quotation_length = len(quotation_str.split())
     # number of quoted words
@@ -23,11 +88,25 @@ def quotation_features(input, input_doc, source):
     else:
         result_dict["ratio_of_quoted_words"] = 0
 
-    # calculate number of quotations from the source texts
+    # find all quotations (also between curly quotes) in the source texts, exactly and normalized
+    source  = quotation_index(source)
+    with stage('quotation.matching'):
+        matches = match_quotations(input, source)
+        found   = {match.text: match.sources for match in matches}
+        for quotation in quotation_list:
+            if quotation not in found:
+                found[quotation] = quotation_sources(quotation, source)
+    number_sources = len(source) if isinstance(source, SourceLibrary) else 1
+
+    # calculate number of quotations from the source texts (straight quotes, exact)
     covered = 0
+    covered_per_source = [0] * number_sources
     for quotation in quotation_list:
-        if quotation in source:
+        numbers = [number for number, (exact, _) in found[quotation].items() if exact is not None]
+        if numbers:
             covered += 1
+        for number in numbers:
+            covered_per_source[number] += 1
     result_dict["number_quotations_from_source"] = covered
     # calculate percentage of quotations from the source texts
     if len(quotation_list) != 0:
@@ -35,5 +114,30 @@ def quotation_features(input, input_doc, source):
     else:
         result_dict["percentage_quotations_from_source"] = 0
 
+    # the same for all quotations, found exactly or with normalized case, whitespace and punctuation
+    normalized = sum(1 for match in matches if match.sources)
+    normalized_per_source = [0] * number_sources
+    for match in matches:
+        for number in match.sources:
+            normalized_per_source[number] += 1
+    result_dict["number_quotations_from_source_normalized"] = normalized
+    if len(matches) != 0:
+        result_dict["percentage_quotations_from_source_normalized"] = normalized / len(matches)
+    else:
+        result_dict["percentage_quotations_from_source_normalized"] = 0
+
+    if isinstance(source, SourceLibrary) and source.per_source_columns:
+        for name, covered, normalized in zip(source.names, covered_per_source, normalized_per_source):
+            result_dict["number_quotations_from_source_" + name] = covered
+            if len(quotation_list) != 0:
+                result_dict["percentage_quotations_from_source_" + name] = covered / len(quotation_list)
+            else:
+                result_dict["percentage_quotations_from_source_" + name] = 0
+            result_dict["number_quotations_from_source_normalized_" + name] = normalized
+            if len(matches) != 0:
+                result_dict["percentage_quotations_from_source_normalized_" + name] = normalized / len(matches)
+            else:
+                result_dict["percentage_quotations_from_source_normalized_" + name] = 0
+
     # print(result_dict)
-    return result_dict
\ No newline at end of file
+    return result_dict
@@ -0,0 +1,120 @@
+import os, csv, sys, json, mmap
+
+# Readers of the input texts: each one streams (filename, text) records lazily, so a corpus of millions of essays
+# is read one record (or one batch of Parquet rows) at a time, and the records feed Batch.score_texts directly.
+# Text is decoded with an explicit encoding (utf-8 by default) instead of the platform default.
+
+# the file extensions read_records recognizes; any other file is read as a single text
+CORPUS_FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv', '.tsv': 'csv', '.parquet': 'parquet'}
+
+
+def read_text_folder(folder_path, recursive=True, suffixes=('.txt',), encoding='utf-8', errors='strict'):
+    '''
+    Read the text files of a folder, and of its subfolders if recursive, in path order
+    :param suffixes: the extensions of the files to read
+    :param encoding, errors: how the files are decoded (see bytes.decode)
+    :return: a generator of (filename, text); the filename is the path relative to the folder, with '/' separators
+             (just the file name for the files directly in the folder)
+    '''
+    for directory, subdirectories, filenames in os.walk(folder_path):
+        # os.walk visits the subfolders in the order of this list
+        subdirectories[:] = sorted(subdirectories) if recursive else []
+        relative = os.path.relpath(directory, folder_path)
+        for filename in sorted(filenames):
+            if filename.endswith(suffixes):
+                # one read of the whole file, decoded once
+                with open(os.path.join(directory, filename), 'rb') as file:
+                    text = file.read().decode(encoding, errors)
+                yield (filename if relative == os.curdir else f'{relative}/{filename}'.replace(os.sep, '/')), text
+
+
+def _record(row, id_field, text_field, number, path):
+    # the (filename, text) of a JSON-lines, CSV or Parquet row; the row number stands in for a missing id
+    text = row.get(text_field)
+    if not isinstance(text, str):
+        raise ValueError(f'{path}, row {number}: no "{text_field}" string')
+    filename = row.get(id_field)
+    return str(number) if filename is None or filename == '' else str(filename), text
+
+
+def read_jsonl(path, id_field='id', text_field='text', encoding='utf-8', errors='strict'):
+    '''
+    Read a JSON-lines file of essays, one object per line (blank lines are skipped)
+    :param id_field: the field of the essay id, used as the filename (the row number if missing)
+    :param text_field: the field of the essay text
+    :return: a generator of (filename, text)
+    '''
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        # memory-mapped, the lines are read from the page cache without copying the file into memory
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for number, line in enumerate(iter(data.readline, b''), 1):
+                if line.strip():
+                    yield _record(json.loads(line.decode(encoding, errors)), id_field, text_field, number, path)
+
+
+def read_csv(path, id_field='id', text_field='text', encoding='utf-8', errors='strict', delimiter=None):
+    '''
+    Read a CSV file of essays with a header row (a .tsv file is read tab-separated)
+    :param id_field: the column of the essay id, used as the filename (the row number if missing)
+    :param text_field: the column of the essay text
+    :param delimiter: the field delimiter (',' or, for .tsv files, tab if None)
+    :return: a generator of (filename, text)
+    '''
+    if delimiter is None:
+        delimiter = '\t' if path.lower().endswith('.tsv') else ','
+    # essays are longer than the default limit of 128 KB per field
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    with open(path, 'r', newline='', encoding=encoding, errors=errors) as file:
+        for number, row in enumerate(csv.DictReader(file, delimiter=delimiter), 1):
+            yield _record(row, id_field, text_field, number, path)
+
+
+def read_parquet(path, id_field='id', text_field='text', batch_size=1024):
+    '''
+    Read a Parquet file of essays, batch_size rows at a time (needs pyarrow)
+    :param id_field: the column of the essay id, used as the filename (the row number if missing)
+    :param text_field: the column of the essay text
+    :return: a generator of (filename, text)
+    '''
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('reading Parquet files needs pyarrow (pip install pyarrow)')
+    parquet_file = pq.ParquetFile(path)
+    names   = parquet_file.schema_arrow.names
+    columns = [text_field] + ([id_field] if id_field in names else [])
+    number  = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        texts = batch.column(text_field).to_pylist()
+        ids   = batch.column(id_field).to_pylist() if id_field in names else [None] * len(texts)
+        for filename, text in zip(ids, texts):
+            number += 1
+            yield _record({id_field: filename, text_field: text}, id_field, text_field, number, path)
+
+
+def read_records(path, id_field='id', text_field='text', encoding='utf-8', errors='strict', recursive=True):
+    '''
+    Read the essays of a folder of .txt files (see read_text_folder) or of a JSON-lines (.jsonl, .ndjson),
+    CSV (.csv, .tsv) or Parquet (.parquet) file; any other file is read as a single essay
+    :param id_field, text_field: the fields of the essay id and text in the JSON-lines, CSV and Parquet files
+    :param encoding, errors: how the text files, JSON-lines and CSV files are decoded
+    :param recursive: also read the .txt files of the subfolders of a folder
+    :return: a generator of (filename, text)
+    '''
+    if os.path.isdir(path):
+        return read_text_folder(path, recursive, encoding=encoding, errors=errors)
+    corpus_format = CORPUS_FORMATS.get(os.path.splitext(path)[1].lower())
+    if corpus_format == 'jsonl':
+        return read_jsonl(path, id_field, text_field, encoding, errors)
+    if corpus_format == 'csv':
+        return read_csv(path, id_field, text_field, encoding, errors)
+    if corpus_format == 'parquet':
+        return read_parquet(path, id_field, text_field)
+    return _read_text_file(path, encoding, errors)
+
+
+def _read_text_file(path, encoding, errors):
+    with open(path, 'rb') as file:
+        yield os.path.basename(path), file.read().decode(encoding, errors)
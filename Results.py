@@ -0,0 +1,210 @@
+import csv
+import numpy as np
+import pandas as pd
+from Batch import column_dtype
+
+# the numpy dtypes of the buffers of the numeric dtypes of the result schema ("Int32" columns also have a mask)
+buffer_dtypes = {'float64': np.float64, 'int32': np.int32, 'Int32': np.int32, 'int64': np.int64}
+# the value of the empty rows of a buffer (0 for the other numeric buffers): NaN, and the code of a missing category
+initial_values = {'float64': np.nan, 'category': -1}
+
+
+def missing(value):
+    '''whether a value of a feature dict is missing: None (a feature not computed) or "N/A" (a feature undefined)'''
+    return value is None or (isinstance(value, str) and value == 'N/A')
+
+
+class ResultTable:
+    '''
+    The feature dicts of a run as typed columns, with the dtypes of the result schema (see Batch.column_dtype) in a
+    fixed column order. Each column is a buffer allocated for capacity rows (doubled when it is full): a numpy
+    array for the numbers, category codes for the category columns, and a list for the strings. So a table of
+    200k essays holds one array per feature instead of 200k dicts, and is returned as a pandas DataFrame or
+    written as Parquet or Arrow without a round trip through the CSV.
+    Missing values (None and "N/A", see missing) are NaN in the float columns and null in the others; a
+    missing value in an "int32" or "int64" column is an error.
+
+    Usage:
+        table = ResultTable()
+        table.extend(score_texts(nlp, records, source))
+        frame = table.to_dataframe()
+        table.write('results.parquet')
+    '''
+
+    def __init__(self, columns=None, capacity=1024):
+        '''
+        :param columns: the columns in output order (default: the columns of the first row)
+        :param capacity: the number of rows the buffers are first allocated for
+        '''
+        self.columns  = None
+        self.schema   = None
+        self.capacity = max(capacity, 1)
+        self.rows     = 0
+        # the buffer of each column, the missing-value masks of the "Int32" columns, and the {value: code}
+        # categories of the category columns
+        self._values     = {}
+        self._masks      = {}
+        self._categories = {}
+        if columns is not None:
+            self._allocate(list(columns))
+
+    def _allocate(self, columns):
+        self.columns = columns
+        self.schema  = {column: column_dtype(column) for column in columns}
+        for column, dtype in self.schema.items():
+            if dtype == 'float64':
+                self._values[column] = np.full(self.capacity, initial_values[dtype])
+            elif dtype in buffer_dtypes:
+                self._values[column] = np.zeros(self.capacity, dtype=buffer_dtypes[dtype])
+                if dtype == 'Int32':
+                    self._masks[column] = np.ones(self.capacity, dtype=bool)
+            elif dtype == 'category':
+                self._values[column] = np.full(self.capacity, initial_values[dtype], dtype=np.int32)
+                self._categories[column] = {}
+            else:
+                self._values[column] = [None] * self.capacity
+
+    def _grow(self):
+        capacity = 2 * self.capacity
+        for column, values in self._values.items():
+            if isinstance(values, list):
+                values.extend([None] * (capacity - self.capacity))
+                continue
+            grown = np.full(capacity, initial_values.get(self.schema[column], 0), dtype=values.dtype)
+            grown[:self.capacity] = values
+            self._values[column] = grown
+        for column, mask in self._masks.items():
+            self._masks[column] = np.concatenate([mask, np.ones(capacity - self.capacity, dtype=bool)])
+        self.capacity = capacity
+
+    def append(self, result_dict):
+        '''add the feature dict of an essay (with the columns of the table) as a row'''
+        if self.columns is None:
+            self._allocate(list(result_dict))
+        elif result_dict.keys() != set(self.columns):
+            raise ValueError(f'the columns of {result_dict.get("Filename")} do not match the columns of the table')
+        if self.rows == self.capacity:
+            self._grow()
+        row = self.rows
+        for column, dtype in self.schema.items():
+            value = result_dict[column]
+            if dtype == 'float64':
+                self._values[column][row] = np.nan if missing(value) else value
+            elif dtype == 'Int32':
+                if not missing(value):
+                    self._values[column][row] = value
+                    self._masks[column][row]  = False
+            elif dtype in buffer_dtypes:
+                if missing(value):
+                    raise ValueError(f'{column} of {result_dict.get("Filename")} is missing')
+                self._values[column][row] = value
+            elif dtype == 'category':
+                if not missing(value):
+                    categories = self._categories[column]
+                    self._values[column][row] = categories.setdefault(value, len(categories))
+            else:
+                self._values[column][row] = value
+        self.rows += 1
+
+    def extend(self, result_dicts):
+        '''add the feature dicts of an iterable (e.g. of score_texts) as rows'''
+        for result_dict in result_dicts:
+            self.append(result_dict)
+
+    def __len__(self):
+        return self.rows
+
+    def to_dataframe(self):
+        ''':return: the table as a pandas DataFrame ("Int32" columns as pandas nullable integers)'''
+        if self.columns is None:
+            return pd.DataFrame()
+        data = {}
+        for column, dtype in self.schema.items():
+            values = self._values[column][:self.rows]
+            if dtype == 'Int32':
+                data[column] = pd.arrays.IntegerArray(values.copy(), self._masks[column][:self.rows].copy())
+            elif dtype == 'category':
+                data[column] = pd.Categorical.from_codes(values, categories=list(self._categories[column]))
+            elif dtype in buffer_dtypes:
+                data[column] = values.copy()
+            else:
+                data[column] = pd.Series(values, dtype=object)
+        return pd.DataFrame(data, columns=self.columns)
+
+    def to_arrow(self):
+        ''':return: the table as a pyarrow Table (category columns as dictionary arrays; needs pyarrow)'''
+        pa = _pyarrow()
+        arrow_types = {'float64': pa.float64(), 'int32': pa.int32(), 'Int32': pa.int32(), 'int64': pa.int64(),
+                       'string': pa.string()}
+        arrays = []
+        for column, dtype in (self.schema or {}).items():
+            values = self._values[column][:self.rows]
+            if dtype == 'Int32':
+                arrays.append(pa.array(values, mask=self._masks[column][:self.rows], type=pa.int32()))
+            elif dtype == 'category':
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(values, mask=values < 0, type=pa.int32()),
+                                                             pa.array(list(self._categories[column]), pa.string())))
+            else:
+                arrays.append(pa.array(values, type=arrow_types.get(dtype)))
+        return pa.Table.from_arrays(arrays, names=self.columns or [])
+
+    def write(self, path):
+        '''
+        write the table to a Parquet (.parquet) or Arrow IPC (.arrow, .feather) file (needs pyarrow)
+        '''
+        _pyarrow()
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            pq.write_table(self.to_arrow(), path)
+        elif path.endswith(('.arrow', '.feather')):
+            import pyarrow.feather as feather
+            feather.write_feather(self.to_arrow(), path)
+        else:
+            raise ValueError(f'{path} is not a .parquet, .arrow or .feather file')
+
+    @classmethod
+    def from_csv(cls, path):
+        '''
+        Read an output CSV file of main.py (see Output.ResultWriter) into a table, with the dtypes of its columns
+        (the floats are parsed exactly, as the CSV writes them)
+        '''
+        with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+            columns = next(csv.reader(csvfile), None)
+        if columns is None:
+            return cls()
+        schema = {column: column_dtype(column) for column in columns}
+        # only the strings keep empty fields and "N/A" as values
+        na_values = {column: ['', 'N/A', 'nan', 'NaN'] for column, dtype in schema.items()
+                     if dtype not in ('string', 'object')}
+        dtypes = {column: 'Int64' if dtype in buffer_dtypes and dtype != 'float64' else
+                          'float64' if dtype == 'float64' else object for column, dtype in schema.items()}
+        frame = pd.read_csv(path, dtype=dtypes, keep_default_na=False, na_values=na_values,
+                            float_precision='round_trip', encoding='utf-8')
+        table = cls(columns, capacity=len(frame))
+        for column, dtype in schema.items():
+            series = frame[column]
+            if dtype == 'float64':
+                table._values[column][:len(frame)] = series.to_numpy(np.float64)
+            elif dtype in buffer_dtypes:
+                mask = series.isna().to_numpy()
+                if dtype != 'Int32' and mask.any():
+                    raise ValueError(f'{column} of {path} has missing values')
+                table._values[column][:len(frame)] = series.fillna(0).to_numpy(buffer_dtypes[dtype])
+                if dtype == 'Int32':
+                    table._masks[column][:len(frame)] = mask
+            elif dtype == 'category':
+                categorical = pd.Categorical(series)
+                table._categories[column] = {value: code for code, value in enumerate(categorical.categories)}
+                table._values[column][:len(frame)] = categorical.codes
+            else:
+                table._values[column][:len(frame)] = series.tolist()
+        table.rows = len(frame)
+        return table
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('writing Parquet and Arrow files needs pyarrow (pip install pyarrow)')
+    return pyarrow
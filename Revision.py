@@ -0,0 +1,266 @@
+import re, string
+from array import array
+from itertools import chain
+from Citation import (scan_citations, paragraph_spans, sentence_spans, contains_citation, citation_word_starts,
+                      star_word_starts, word_indices, citation_char_starts, sentence_position_features,
+                      word_position_features, char_position_features, coverage_features)
+from Plagiarism import (SourceIndex, string_preprocessing, ngram_token_ids, ngram_separator_pattern,
+                        id_containment_scores, containment_scores, get_tokens, trigram_keys, shared_trigrams,
+                        trigram_similarity, plagiarism_result, library_plagiarism_features, trigram_id_bits)
+from Quotation import quotation_features
+from Batch import parse_texts, line_breaks, paragraph_boundary
+
+# Incremental scoring of the drafts of an essay. A draft is split into blocks, each a paragraph with the
+# whitespace after it, and the partial results of every block (its sentences and citations, its tokens, their
+# source vocabulary ids and its ngram words) depend only on the block text. A revision reuses the blocks it
+# shares with the previous draft, so only the paragraphs that changed are parsed and scanned; the features are
+# then aggregated over the blocks, with the same values as scoring the whole revision (see Batch.essay_features).
+# The essay-wide steps left are vectorized passes over the block results (the ngram and trigram look-ups) and
+# the quotation features, which are recomputed on the whole text.
+
+# a run of word characters at the start of a text (the words of the ngram features are runs of 2 or more)
+word_run = re.compile(r"(?u)\w*")
+punctuation_table = str.maketrans('', '', string.punctuation)
+
+
+def draft_blocks(text):
+    '''
+    Split a draft into blocks: each block ends with the whitespace after a paragraph, so no sentence, citation or
+    token of the features crosses two blocks. A single line break between a word and a digit or a comma is kept
+    inside a block, since the citation patterns ("Source\\n1 ", "et al.,") can match across it.
+    :return: a list of the block texts, which join to the text
+    '''
+    blocks, start = [], 0
+    for boundary in paragraph_boundary.finditer(text):
+        start_of_run = boundary.start() == 0 or not text[boundary.start() - 1].isspace()
+        if start_of_run and boundary.end() - boundary.start() == 1 and text[boundary.end()] in '0123456789,':
+            continue
+        blocks.append(text[start:boundary.end()])
+        start = boundary.end()
+    blocks.append(text[start:])
+    return blocks
+
+
+class _Block:
+    # the partial results of a block, which depend only on its text (and the source of the draft)
+    __slots__ = ('text', 'citations', 'paragraphs', 'open_line', 'word_count', 'paren_word_count', 'tokens',
+                 'essay_tokens', 'ids', 'solid', 'head', 'tail', 'inner_ids', 'scan', 'star_starts', 'word_starts',
+                 'char_starts', 'indices')
+
+    def __init__(self, text, tokens, source, unknown):
+        self.text = text
+        # the citations, and per paragraph its number of sentences and the numbers of its citation sentences
+        self.citations  = scan_citations(text)
+        citation_starts = [citation.start for citation in self.citations]
+        self.paragraphs = []
+        for start, end in paragraph_spans(text):
+            sentences = sentence_spans(text, start, end)
+            self.paragraphs.append((len(sentences), [number for number, (sentence_start, sentence_end)
+                                                     in enumerate(sentences)
+                                                     if contains_citation(self.citations, citation_starts,
+                                                                          sentence_start, sentence_end)]))
+        # whether the text after the last line break is the start of the first line of the next block
+        self.open_line = not text.endswith(tuple(line_breaks))
+        self.word_count       = len(text.split())
+        self.paren_word_count = len(text.replace('(', '').replace(')', '').split())
+        # the words that start with "***", and the occurrences of each citation text of the draft, found as the draft
+        # needs them
+        self.star_starts = star_word_starts(text)
+        self.word_starts = {}
+        self.char_starts = {}
+        self.indices     = None
+
+        self.tokens       = tokens
+        self.essay_tokens = get_tokens(self.tokens)
+        self.ids          = None
+        self.scan         = None
+        self.solid, self.head, self.tail, self.inner_ids = True, '', '', None
+        if isinstance(source, SourceIndex):
+            self.ids = _token_ids(self.essay_tokens, source.token_vocabulary, unknown)
+            # as string_preprocessing (without its lstrip of the whole text): words at the ends of the block
+            # can join the words of the next and previous blocks, once the line breaks are removed
+            piece = text.replace('\n', '').replace('\r', '').translate(punctuation_table).lower()
+            head = word_run.match(piece).end()
+            if head < len(piece):
+                tail = len(piece)
+                while not ngram_separator_pattern.match(piece, tail - 1):
+                    tail -= 1
+                self.solid, self.head, self.tail = False, piece[:head], piece[tail:]
+                self.inner_ids = ngram_token_ids(piece[head:tail], source.vocabulary)
+            else:
+                self.head = piece
+
+    def citation_word_starts(self, citation_texts):
+        starts = set(self.star_starts)
+        for citation in citation_texts:
+            if citation not in self.word_starts:
+                self.word_starts[citation] = citation_word_starts(self.text, (citation,))
+            starts.update(self.word_starts[citation])
+        return starts
+
+    def citation_char_starts(self, citation_texts):
+        starts = set()
+        for citation in citation_texts:
+            if citation not in self.char_starts:
+                self.char_starts[citation] = citation_char_starts(self.text, (citation,))
+            starts.update(self.char_starts[citation])
+        return starts
+
+    def word_indices(self, citation_texts):
+        starts = frozenset(self.citation_word_starts(citation_texts))
+        if self.indices is None or self.indices[0] != starts:
+            self.indices = (starts, word_indices(self.text, starts))
+        return self.indices[1]
+
+
+def _token_ids(tokens, vocabulary, unknown):
+    # essay_token_ids(), with the ids of the tokens not in the vocabulary kept for all the drafts of the essay
+    size = len(vocabulary)
+    return array('I', [vocabulary.get(token) or unknown.setdefault(token, size + len(unknown) + 1)
+                       for token in tokens])
+
+
+class Draft:
+    '''
+    A scored draft of an essay: its feature dict and the partial results of its blocks, from which the next
+    revision is scored (see score_draft)
+    '''
+
+    def __init__(self, filename, text, source, blocks, unknown, features):
+        self.filename = filename
+        self.text     = text
+        self.source   = source
+        self.blocks   = blocks
+        self.unknown  = unknown
+        self.features = features
+
+    def revise(self, text, nlp, filename=None):
+        '''score a revision of this draft (see score_draft)'''
+        return score_draft(self.filename if filename is None else filename, text, nlp, self.source, self)
+
+
+def score_draft(filename, text, nlp, source, previous=None):
+    '''
+    Score a draft of an essay, reusing the blocks it shares with the previous draft
+    :param text: the raw text of the draft
+    :param nlp: the spaCy pipeline (see Batch.feature_pipeline), which parses only the new blocks
+    :param source: a SourceIndex or SourceLibrary (with a SourceLibrary, only the parse and the citation
+                   features are incremental)
+    :param previous: the Draft of the previous version (scored against the same source), or None
+    :return: a Draft, whose features are the feature dict of Batch.essay_features
+    '''
+    texts = draft_blocks(text)
+    known, unknown = {}, {}
+    if previous is not None and previous.source is source:
+        known   = {block.text: block for block in previous.blocks}
+        unknown = previous.unknown
+    new_texts = list(dict.fromkeys(block_text for block_text in texts if block_text not in known))
+    for tokens, block_text in parse_texts(nlp, ((block_text, block_text) for block_text in new_texts)):
+        known[block_text] = _Block(block_text, tokens, source, unknown)
+    blocks = [known[block_text] for block_text in texts]
+
+    if isinstance(source, SourceIndex) and len(source.token_vocabulary) + len(unknown) >= 1 << trigram_id_bits:
+        # the ids of tokens the essay lost over its drafts: number the unknown tokens of this draft again
+        unknown = {}
+        for block in dict.fromkeys(blocks):
+            block.ids = _token_ids(block.essay_tokens, source.token_vocabulary, unknown)
+        if len(source.token_vocabulary) + len(unknown) >= 1 << trigram_id_bits:
+            raise ValueError(f'more than {(1 << trigram_id_bits) - 1} distinct tokens do not fit in the trigram keys')
+
+    result_dict = {**draft_citation_features(blocks), **draft_plagiarism_features(text, blocks, source),
+                   **quotation_features(text, list(chain.from_iterable(block.tokens for block in blocks)), source)}
+    return Draft(filename, text, source, blocks, unknown, {'Filename': filename, **result_dict})
+
+
+def draft_citation_features(blocks):
+    '''the citation_features() of a draft, aggregated over its blocks'''
+    result_dict = {}
+
+    # the sentence positions of the citation sentences (as citation_sent_position numbers the paragraphs and
+    # sentences of the whole text)
+    paragraphs = []
+    for number, block in enumerate(blocks):
+        block_paragraphs = block.paragraphs
+        if block.open_line and number < len(blocks) - 1 and block_paragraphs:
+            # the whitespace before the first line of the next block
+            block_paragraphs = block_paragraphs[:-1]
+        paragraphs.extend(block_paragraphs)
+    how_many_sent_in_essay = sum(how_many_sent_in_para for how_many_sent_in_para, _ in paragraphs)
+    citation_data_list, para_position_list = [], []
+    sent_no = 0
+    for in_which_para, (how_many_sent_in_para, citation_sentences) in enumerate(paragraphs, 1):
+        for sentence in citation_sentences:
+            raw_location_in_para  = sentence + 1
+            raw_location_in_essay = sent_no + raw_location_in_para
+            citation_data_list.append([raw_location_in_essay, raw_location_in_essay / how_many_sent_in_essay,
+                                       raw_location_in_para, raw_location_in_para / how_many_sent_in_para])
+            para_position_list.append(in_which_para)
+        sent_no += how_many_sent_in_para
+    sentence_position_features(result_dict, citation_data_list, para_position_list, len(paragraphs))
+
+    # the word and character positions of the occurrences of all citation texts of the draft
+    citations = sorted((citation for block in blocks for citation in block.citations),
+                       key=lambda citation: citation.pattern)
+    direct_citation = set(citation.text for citation in citations)
+    index, all_char_position = [], []
+    words_before, chars_before = 0, 0
+    for block in blocks:
+        index.extend(words_before + block_index for block_index in block.word_indices(direct_citation))
+        if direct_citation:
+            all_char_position.extend(chars_before + start for start in block.citation_char_starts(direct_citation))
+        words_before += block.paren_word_count
+        chars_before += len(block.text)
+    word_position_features(result_dict, index)
+    char_position_features(result_dict, all_char_position)
+
+    coverage_features(result_dict, [citation.text for citation in citations],
+                      sum(block.word_count for block in blocks))
+    return result_dict
+
+
+def draft_plagiarism_features(text, blocks, source):
+    '''the plagiarism_features() of a draft, from the tokens and ngram words of its blocks'''
+    essay_token = [token for block in blocks for token in block.essay_tokens]
+    if not isinstance(source, SourceIndex):
+        return library_plagiarism_features(string_preprocessing(text), essay_token, source, text)
+
+    if 'Σ' in text:
+        # lower-casing a capital sigma depends on the letters around it, which may be in the next block
+        scores = containment_scores(string_preprocessing(text), source)
+    else:
+        # the ngram words of the blocks, joining the words at the ends of consecutive blocks
+        word_ids, carry = array('I'), ''
+        for block in blocks:
+            if block.solid:
+                carry += block.head
+                continue
+            word = carry + block.head
+            if len(word) >= 2:
+                word_ids.append(source.vocabulary.get(word, 0))
+            word_ids.extend(block.inner_ids)
+            carry = block.tail
+        if len(carry) >= 2:
+            word_ids.append(source.vocabulary.get(carry, 0))
+        scores = id_containment_scores(word_ids, source)
+
+    essay_ids = array('I')
+    for block in blocks:
+        essay_ids.extend(block.ids)
+    essay_trigram  = trigram_keys(essay_ids)
+    source_trigram = source.trigram_keys
+    trigram_scores = trigram_similarity(shared_trigrams(source_trigram, essay_trigram), len(essay_trigram),
+                                        len(source_trigram))
+
+    # the longest common sequence: the matching continues from block to block, and a block is scanned again
+    # only when the matching enters it in another state than before
+    state, length, Longest_common_sequence = 0, 0, 0
+    for block in blocks:
+        if block.scan is None or block.scan[0] != (state, length):
+            block.scan = ((state, length), source.automaton.scan(block.ids, state, length))
+        state, length, longest = block.scan[1]
+        Longest_common_sequence = max(Longest_common_sequence, longest)
+
+    # the copied spans are aligned on the whole draft (in time about linear in its length)
+    alignment = source.spans.align(text)
+    return plagiarism_result(scores, trigram_scores, Longest_common_sequence,
+                             (len(alignment.spans), alignment.copied_ratio), len(essay_token))
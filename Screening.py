@@ -0,0 +1,40 @@
+from collections import namedtuple
+import numpy as np
+from Plagiarism import kgram_hashes, quotation_pattern, screening_ngram_size
+
+
+class Screening(namedtuple('Screening', ['containment_measure', 'ngram_overlap', 'quotations'],
+                           defaults=(0.02, 0.005, 1))):
+    '''
+    Thresholds of the screening tier of the plagiarism features. The screening computes cheap signals of an essay
+    from its tokens: the trigram containment measure (and Jaccard similarity, which it reports exactly), the share
+    of its token 6-grams found in the source (hashed) and its number of quotations. An essay with a signal at its
+    threshold gets the full tier, which adds the containment scores, the longest common sequence and the copied
+    spans; in the screening tier these columns are None, and the "Screening_tier" column tells the tiers apart.
+    '''
+    __slots__ = ()
+
+    def tier(self, input, containment_measure, overlap):
+        '''
+        :param input: the raw essay text
+        :return: the tier of an essay with these signals: "full" if one reaches its threshold, else "screened"
+        '''
+        if containment_measure >= self.containment_measure or overlap >= self.ngram_overlap or \
+                len(quotation_pattern.findall(input)) >= self.quotations:
+            return 'full'
+        return 'screened'
+
+    def screen(self, input, essay_ids, screening_keys, containment_measure):
+        '''
+        Screen an essay
+        :param input: the raw essay text
+        :param essay_ids: the essay_token_ids() of the essay, in the token vocabulary of the screening keys
+        :param screening_keys: the Plagiarism.screening_ngram_keys() of the source
+        :param containment_measure: the trigram containment measure of the essay
+        :return: (full, result_dict): whether the essay gets the full tier, and the dict of its
+                 Plagiarism.SCREENING_COLUMNS
+        '''
+        essay_keys = kgram_hashes(np.frombuffer(essay_ids, dtype=np.uint32), screening_ngram_size)
+        overlap    = float(np.isin(essay_keys, screening_keys).mean()) if len(essay_keys) != 0 else 0.0
+        tier       = self.tier(input, containment_measure, overlap)
+        return tier == 'full', {'Screening_tier': tier, 'Screening_ngram_overlap': overlap}
@@ -0,0 +1,174 @@
+import sys, math, time, queue, threading
+from flask import Flask, request, jsonify
+from Batch import score_texts, select_features, feature_pipeline, SOURCE_GROUPS
+
+
+class _Request:
+    # the essays of one HTTP request, waiting for their batch to be scored
+    __slots__ = ('records', 'results', 'error', 'done')
+
+    def __init__(self, records):
+        self.records = records
+        self.results = None
+        self.error   = None
+        self.done    = threading.Event()
+
+
+class MicroBatcher:
+    '''
+    Scores the essays of concurrent requests together: a scoring thread takes the first waiting request, adds
+    the requests arriving within max_wait seconds (up to max_batch essays), and scores them all with one
+    score_texts call, so they share the nlp.pipe batch and the vectorized plagiarism features.
+    The spaCy pipeline and the source index are loaded once and stay in memory.
+    '''
+
+    def __init__(self, nlp, source, features=None, max_batch=64, max_wait=0.005, screening=None):
+        '''
+        :param nlp: the spaCy pipeline (see Batch.feature_pipeline)
+        :param source: a SourceIndex or SourceLibrary (None if the selected features do not use the source)
+        :param features: the features to compute (see Batch.select_features)
+        :param max_batch: the largest number of essays scored together
+        :param max_wait: how long the first request of a batch waits for others, in seconds
+        :param screening: the Screening.Screening thresholds of the plagiarism features (None for no screening)
+        '''
+        self.nlp       = nlp
+        self.source    = source
+        self.features  = features
+        self.screening = screening
+        self.max_batch = max_batch
+        self.max_wait  = max_wait
+        self.batches   = 0
+        self.essays    = 0
+        self._queue  = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def score(self, records):
+        '''
+        Score essays in the next batch (blocks until they are scored)
+        :param records: a list of (filename, text)
+        :return: a list of feature dicts (as main.py writes them), in the order of the records
+        '''
+        pending = _Request(records)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.results
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            size = len(batch[0].records)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    pending = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if pending is None:
+                    # closing: score what was collected, then stop
+                    self._queue.put(None)
+                    break
+                batch.append(pending)
+                size += len(pending.records)
+            self._score(batch)
+
+    def _score_records(self, records):
+        return list(score_texts(self.nlp, records, self.source, batch_size=self.max_batch, workers=1,
+                                features=self.features, screening=self.screening))
+
+    def _score(self, batch):
+        records = [record for pending in batch for record in pending.records]
+        try:
+            results = self._score_records(records)
+            position = 0
+            for pending in batch:
+                pending.results = results[position:position + len(pending.records)]
+                position += len(pending.records)
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].error = error
+            else:
+                # the essays of one request failed the batch: score each request on its own, so that only the
+                # requests whose essays fail get an error
+                for pending in batch:
+                    try:
+                        pending.results = self._score_records(pending.records)
+                    except Exception as request_error:
+                        pending.error = request_error
+        self.batches += 1
+        self.essays  += len(records)
+        for pending in batch:
+            pending.done.set()
+
+    def close(self):
+        '''score the waiting requests and stop the scoring thread'''
+        self._queue.put(None)
+        self._thread.join()
+
+
+def json_features(final_dict):
+    '''a feature dict with nan values (e.g. containment scores of very short essays) as null, for JSON'''
+    return {column: None if isinstance(value, float) and math.isnan(value) else value
+            for column, value in final_dict.items()}
+
+
+def create_app(nlp, source, features=None, max_batch=64, max_wait=0.005, screening=None):
+    '''
+    The scoring service, a Flask app (also usable in-process, e.g. with app.test_client()):
+        POST /score        {"filename": ..., "text": ...}                  -> the feature dict of the essay
+        POST /score/batch  {"essays": [{"filename": ..., "text": ...}]}    -> a list of feature dicts
+                           (or just the list of essays)
+        GET  /health                                                       -> the number of batches and essays scored
+    The arguments are those of MicroBatcher, which the app keeps in app.extensions['batcher'].
+    '''
+    app = Flask(__name__)
+    # keep the columns in the order of the output CSV
+    app.json.sort_keys = False
+    batcher = MicroBatcher(nlp, source, features, max_batch, max_wait, screening)
+    app.extensions['batcher'] = batcher
+
+    def essay_record(essay, number):
+        if not isinstance(essay, dict) or not isinstance(essay.get('text'), str):
+            raise ValueError('an essay is an object with a "text" string (and optionally a "filename")')
+        return str(essay.get('filename', number)), essay['text']
+
+    @app.route('/health', methods=['GET'])
+    def health():
+        return jsonify({'status': 'ok', 'batches': batcher.batches, 'essays': batcher.essays})
+
+    @app.route('/score', methods=['POST'])
+    def score():
+        try:
+            record = essay_record(request.get_json(silent=True), 0)
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+        return jsonify(json_features(batcher.score([record])[0]))
+
+    @app.route('/score/batch', methods=['POST'])
+    def score_batch():
+        essays = request.get_json(silent=True)
+        if isinstance(essays, dict):
+            essays = essays.get('essays')
+        if not isinstance(essays, list):
+            return jsonify({'error': 'expected a list of essays, or an object with an "essays" list'}), 400
+        try:
+            records = [essay_record(essay, number) for number, essay in enumerate(essays)]
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+        return jsonify([json_features(final_dict) for final_dict in batcher.score(records)])
+
+    return app
+
+
+if __name__ == '__main__':
+    # Usage: python Service.py [port]   (with the source, features and spaCy model configured in main.py)
+    import main
+    nlp = feature_pipeline(main.features, main.spacy_model)
+    groups, _ = select_features(main.features)
+    source_index = main.load_source_index(nlp) if SOURCE_GROUPS.intersection(groups) else None
+    app = create_app(nlp, source_index, main.features, screening=main.screening)
+    app.run(host='127.0.0.1', port=int(sys.argv[1]) if len(sys.argv) > 1 else 5000, threaded=True)
@@ -1,53 +1,205 @@
-import os, csv
-import spacy
-from Citation import citation_features
-from Plagiarism import plagiarism_features
-from Quotation import quotation_features
+import os, pickle
+from collections import Counter
+from Plagiarism import SourceIndex, SourceLibrary, INDEX_VERSION
+from Batch import score_texts, results_fingerprint, select_features, feature_pipeline, parse_text, SOURCE_GROUPS
+from Output import ResultWriter, copied_span_report, write_copied_spans
+from Cache import FeatureCache
+from Profiling import Profiler
+from Collusion import find_collusion, write_collusion_pairs
+from Readers import read_records
+from Distributed import Coordinator, open_backend
 
-# Path to the folder containing the text files (files must be in .txt format)
-texts_folder_path = 'path/to/texts_folder'
+# Path to the texts: a folder of .txt files (with its subfolders; the filename of a text is its path in the folder),
+# or a JSON-lines (.jsonl), CSV (.csv, .tsv) or Parquet (.parquet) file with one text per row, read as a stream
+texts_path = 'path/to/texts_folder'
 
-# Path to the source text file (in .txt format)
+# For JSON-lines, CSV and Parquet files: the fields of the text id (used as the filename) and of the text.
+# The encoding of the texts and of the source texts
+text_id_field = 'id'
+text_field    = 'text'
+text_encoding = 'utf-8'
+
+# Path to the source text file (in .txt format), or to a folder of source text files (all of them are used)
 source_text_path  = 'path/to/source_text.txt'
 
-# Path for the output CSV file
+# Path for the pre-computed source index (created on the first run, reused while the source text is unchanged)
+source_index_path = 'path/to/source_index.pkl'
+
+# Path for the output CSV file (rows are written as the texts are processed; a manifest of the processed
+# texts is kept next to it, so a rerun only processes the texts that are new or changed)
 output_csv_path = 'path/to/output.csv'
 
-final_result_list = []
-
-# loading the english language model of spacy
-nlp = spacy.load('en_core_web_md')
-# Disable unnecessary components to speed up processing
-nlp.disable_pipes('ner', 'parser')
-
-# Read the source text and input texts from the folder
-with open(source_text_path, 'r') as file:
-    source_text = file.read()
-    source_doc  = nlp(source_text)
-for filename in os.listdir(texts_folder_path):
-    if filename.endswith('.txt'):
-        with open(os.path.join(texts_folder_path, filename), 'r') as file:
-            text     = file.read()
-            text_doc = nlp(text)
-            print("File name: ", filename)
-            # Process the text through each module
-            citation_result   = citation_features(text)
-            plagiarism_result = plagiarism_features(text, text_doc, source_text, source_doc)
-            quotation_result  = quotation_features(text, text_doc, source_text)
-            # Merge the result dictionaries
-            merged_dict = {**citation_result, **plagiarism_result, **quotation_result}
-            final_dict = {'Filename': filename, **merged_dict}
-            final_result_list.append(final_dict)
-
-headers = final_result_list[0].keys()
-
-# Write the list of dictionaries to a CSV file
-with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-    writer = csv.DictWriter(csvfile, fieldnames=headers)
-    # Write the header
-    writer.writeheader()
-    # Write the rows
-    for result_dict in final_result_list:
-        writer.writerow(result_dict)
-
-print(f'Processing complete. Results saved to {output_csv_path}')
+# Path for a typed copy of the output (None skips it): a Parquet (.parquet) or Arrow (.arrow, .feather) file with the
+# rows and columns of the output CSV file and a fixed dtype per column, which loads much faster than the CSV
+# (see Results.py; needs pyarrow)
+columnar_output_path = None
+
+# Path for the feature cache (parsed texts and feature results, reused when texts are processed again;
+# None disables the cache), and its size limit in bytes
+feature_cache_path = 'path/to/feature_cache.sqlite'
+feature_cache_size = 2 * 1024 ** 3
+
+# The features to compute: None for all, or a list of feature groups ('citation', 'plagiarism', 'quotation')
+# and/or column names; only what the selected features need is loaded (citation features need no spaCy model
+# and no source text)
+features = None
+
+# The spaCy model to tokenize the texts with: None for a blank English tokenizer, which gives the same token data
+# as a trained English model and loads much faster, or a model name such as 'en_core_web_md'
+spacy_model = None
+
+# Path for a CSV file of the pairs of texts that are similar to each other (essay-vs-essay plagiarism within the
+# texts; None skips it), and the trigram Jaccard similarity from which a pair is reported (see Collusion.py for
+# the MinHash/LSH settings trading recall against speed)
+collusion_csv_path  = None
+collusion_threshold = 0.5
+
+# Path for a CSV file of the passages of the texts copied from the source (None skips it): one row per copied span
+# of 5 words or more, with its character offsets in the text and in the source, and the share of the text copied
+copied_spans_csv_path = None
+
+# Tiered screening of the plagiarism features: None computes all of them for every text, or a Screening.Screening
+# first computes cheap signals (the trigram containment measure, the share of token 6-grams found in the source and
+# the number of quotations) and the containment scores, longest common sequence and copied spans only for the texts
+# with a signal at its threshold; the other texts leave these columns empty, and the "Screening_tier" column gives
+# the tier. To turn it on (with the default thresholds shown):
+#     from Screening import Screening
+#     screening = Screening(containment_measure=0.02, ngram_overlap=0.005, quotations=1)
+screening = None
+
+# Profiling of the stages of each text (spaCy parse, each feature group and its parts): a path for a JSON-lines
+# trace of the stage times (None for no trace), whether to add them to the output as "time_<stage>" columns,
+# and whether to also measure the peak memory of each stage (slower); a summary is printed at the end of the run.
+# With none of them set, nothing is measured.
+profile_trace_path = None
+profile_columns    = False
+profile_memory     = False
+
+# Number of worker processes for the feature extraction (None: one per CPU core),
+# and the batch size and number of processes of the spaCy parse
+workers      = None
+batch_size   = 64
+nlp_process  = 1
+
+# Distributed scoring: the URL of a queue shared with worker processes on other machines ('file:///path/to/folder'
+# for a folder on a filesystem they all mount, or 'redis://host:6379/0'), or None to score in this process.
+# Start the workers on each machine with: python Distributed.py worker <queue URL> [number of processes]
+# (the feature cache and profiling apply to scoring in this process only)
+distributed_queue = None
+
+
+def read_texts():
+    # Read the input texts, one at a time, in order
+    return read_records(texts_path, text_id_field, text_field, text_encoding)
+
+
+def load_source_index(nlp):
+    '''
+    Read the source text(s) and build (or load) the source index; a folder of sources gives a source library
+    '''
+    if os.path.isdir(source_text_path):
+        source_texts = {}
+        for filename in sorted(os.listdir(source_text_path)):
+            if filename.endswith('.txt'):
+                with open(os.path.join(source_text_path, filename), 'r', encoding=text_encoding) as file:
+                    source_texts[filename[:-len('.txt')]] = file.read()
+    else:
+        with open(source_text_path, 'r', encoding=text_encoding) as file:
+            source_texts = file.read()
+    source_index = None
+    if os.path.exists(source_index_path):
+        # reuse the saved index only if it was built from the same source text(s) by this version of the code
+        with open(source_index_path, 'rb') as file:
+            source_index = pickle.load(file)
+        if getattr(source_index, 'index_version', None) != INDEX_VERSION:
+            source_index = None
+        elif isinstance(source_index, SourceIndex) and source_index.source_text == source_texts:
+            pass
+        elif isinstance(source_index, SourceLibrary) and source_index.source_texts == source_texts:
+            pass
+        else:
+            source_index = None
+    if source_index is None:
+        if isinstance(source_texts, str):
+            source_index = SourceIndex(source_texts, parse_text(nlp, source_texts))
+        else:
+            source_index = SourceLibrary.from_sources({name: SourceIndex(text, parse_text(nlp, text))
+                                                       for name, text in source_texts.items()})
+        source_index.save(source_index_path)
+    return source_index
+
+
+if __name__ == '__main__':
+    # the spaCy tokenizer (None if the selected features need none)
+    nlp = feature_pipeline(features, spacy_model)
+    groups, _ = select_features(features)
+
+    # Read the source text(s) and build (or load) the source index; a folder of sources gives a source library
+    source_index = None
+    if SOURCE_GROUPS.intersection(groups):
+        source_index = load_source_index(nlp)
+
+    # Parse the texts in batches, process them through each module in the worker processes,
+    # and write each result to the CSV file
+    # (or hand them out to the workers of the distributed queue)
+    cache, profiler = None, None
+    if feature_cache_path and not distributed_queue:
+        cache = FeatureCache(feature_cache_path, feature_cache_size)
+    if (profile_trace_path or profile_columns or profile_memory) and not distributed_queue:
+        profiler = Profiler(profile_trace_path, profile_columns, profile_memory)
+    extra_columns = (['time', 'peak_memory'] if profile_memory else ['time']) if profiler and profile_columns else None
+    fingerprint   = results_fingerprint(source_index, features, extra_columns, screening)
+    tiers         = Counter()
+    table         = None
+    if columnar_output_path:
+        # Results.py (and pandas) is only imported for a typed copy of the output
+        from Results import ResultTable
+        table = ResultTable()
+    with ResultWriter(output_csv_path, fingerprint=fingerprint) as writer:
+        if distributed_queue:
+            coordinator = Coordinator(open_backend(distributed_queue), source_index, features, spacy_model,
+                                      batch_size=batch_size, screening=screening)
+            results = coordinator.score(writer.pending(read_texts()))
+        else:
+            results = score_texts(nlp, writer.pending(read_texts()), source_index, batch_size=batch_size,
+                                  n_process=nlp_process, workers=workers, cache=cache, features=features,
+                                  profiler=profiler, screening=screening)
+        for final_dict in results:
+            print("File name: ", final_dict['Filename'])
+            writer.write(final_dict)
+            if table is not None:
+                table.append(final_dict)
+            if 'Screening_tier' in final_dict:
+                tiers[final_dict['Screening_tier']] += 1
+    if cache is not None:
+        cache.close()
+    if profiler is not None:
+        profiler.close()
+        print(profiler.format_summary())
+    if table is not None:
+        if len(table) != len(writer.scored):
+            # the output has rows of earlier runs: read all of them back
+            table = ResultTable.from_csv(output_csv_path)
+        table.write(columnar_output_path)
+        print(f'{len(table)} rows saved to {columnar_output_path}')
+    if tiers:
+        print(f"Screening: {tiers['screened']} texts in the screening tier only, {tiers['full']} texts with the full "
+              f"plagiarism features")
+
+    # Find the copied passages of the texts in the source(s), as spans of words aligned with a k-gram index
+    if copied_spans_csv_path:
+        if source_index is None:
+            source_index = load_source_index(nlp or feature_pipeline(['plagiarism'], spacy_model))
+        count = write_copied_spans(copied_span_report(read_texts(), source_index), copied_spans_csv_path)
+        print(f'{count} copied spans saved to {copied_spans_csv_path}')
+
+    # Compare the texts with each other: candidate pairs from MinHash/LSH, checked with the exact trigram Jaccard
+    # similarity and longest common sequence
+    if collusion_csv_path:
+        pairs = find_collusion(read_texts(), nlp or feature_pipeline(['plagiarism'], spacy_model),
+                               collusion_threshold)
+        write_collusion_pairs(pairs, collusion_csv_path)
+        print(f'{len(pairs)} pairs of similar texts saved to {collusion_csv_path}')
+
+    print(f'Processing complete: {writer.written} texts processed, {writer.skipped} unchanged texts skipped. '
+          f'Results saved to {output_csv_path}')